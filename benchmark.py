@@ -0,0 +1,606 @@
+"""
+Benchmarks and load tests for the MQTT publishing path.
+
+Runs linux2mqtt against a fake MQTT client that stands in for the broker and
+records every publish and the size it would have on the wire. The hardware
+backends are replaced by synthetic sensors, so the results only depend on the
+daemon itself.
+
+Usage:
+    python benchmark.py batch [--sensors N] [--intervals N]
+    python benchmark.py load [--sensors N] [--buttons N] [--ticks N] [--batch]
+    python benchmark.py v5 [--sensors N] [--intervals N]
+    python benchmark.py startup
+    python benchmark.py power [--packages N] [--ticks N]
+    python benchmark.py resume
+    python benchmark.py cgroups [--cgroups N] [--ticks N]
+"""
+import argparse
+import os
+import random
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+from loguru import logger
+from paho.mqtt.client import topic_matches_sub
+
+from settings import Settings
+from main import Linux2MQTT
+from host_sensors import HostSensors, MQTTSensor
+from commands import LinuxCommands, MQTTButton
+from power_sensors import PowerSensors
+from cgroup_sensors import CgroupSensors
+from suspend import SuspendDetector
+
+BENCH_HOST = "benchhost"
+
+
+def _varint_size(value):
+    size = 1
+    while value > 127:
+        value //= 128
+        size += 1
+    return size
+
+
+class FakeMQTTClient:
+    """
+    Stands in for paho's mqtt.Client and the broker.
+    Counts PUBLISH packets and their size, keeps retained messages like a broker
+    and delivers messages to the callbacks registered with message_callback_add.
+    """
+
+    def __init__(self, protocol=4):
+        # 4 is MQTT 3.1.1, 5 is MQTT 5
+        self.protocol = protocol
+        self.publishes = 0
+        self.bytes = 0
+        self.messages = []
+        self.keep_messages = True
+        self.subscriptions = set()
+        self.callbacks = {}
+        self.retained = {}
+        self.connected = False
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        if payload is None:
+            payload = b""
+        elif not isinstance(payload, bytes):
+            payload = str(payload).encode()
+        # Fixed header, topic length, topic, packet id for QoS > 0, properties with MQTT 5, payload
+        remaining = 2 + len(topic.encode()) + (2 if qos else 0) + len(payload)
+        if self.protocol == 5:
+            remaining += len(properties.pack()) if properties is not None else 1
+        self.publishes += 1
+        self.bytes += 1 + _varint_size(remaining) + remaining
+        if self.keep_messages:
+            self.messages.append((topic, payload, retain))
+        if retain:
+            if payload:
+                self.retained[topic] = payload
+            else:
+                self.retained.pop(topic, None)
+        return SimpleNamespace(rc=0)
+
+    def subscribe(self, topic, qos=0):
+        self.subscriptions.add(topic)
+        callback = self.callbacks.get(topic)
+        if callback is not None:
+            for retained_topic, payload in list(self.retained.items()):
+                if topic_matches_sub(topic, retained_topic):
+                    callback(self, None, SimpleNamespace(topic=retained_topic, payload=payload, retain=True))
+
+    def unsubscribe(self, topic):
+        self.subscriptions.discard(topic)
+
+    def message_callback_add(self, topic, callback):
+        self.callbacks[topic] = callback
+
+    def message_callback_remove(self, topic):
+        self.callbacks.pop(topic, None)
+
+    def deliver(self, topic, payload):
+        message = SimpleNamespace(topic=topic, payload=payload.encode(), retain=False)
+        self.callbacks[topic](self, None, message)
+
+    def username_pw_set(self, username, password=None):
+        pass
+
+    def will_set(self, topic, payload=None, qos=0, retain=False):
+        pass
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        self.connected = False
+
+    def is_connected(self):
+        return self.connected
+
+    def reset(self):
+        self.publishes = 0
+        self.bytes = 0
+        self.messages = []
+
+
+class BenchLinux2MQTT(Linux2MQTT):
+    """
+    Linux2MQTT connected to a FakeMQTTClient instead of a broker.
+    """
+
+    def _mqtt_connect(self):
+        self.mqtt_client = FakeMQTTClient(5 if self.mqtt_v5 else 4)
+        self.mqtt_client.connected = True
+        self._on_mqtt_connect(self.mqtt_client, None, {}, 0, SimpleNamespace(TopicAliasMaximum=1024))
+
+
+def write_config(directory, sections):
+    lines = []
+    for section, options in sections.items():
+        lines.append(f"[{section}]")
+        lines += [f"{key} = {value}" for key, value in options.items()]
+    path = os.path.join(directory, "linux2mqtt.conf")
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return Settings(["-c", path])
+
+
+def default_sections(**sensor_options):
+    return {
+        "mqtt": {"homeassistant": True, "discovery_settle_time": 0},
+        "client": {"name": BENCH_HOST, "update_interval": 1},
+        "sensors": {"enable": True, **sensor_options},
+        "commands": {"enable": True},
+    }
+
+
+def synthetic_sensors(publish_topic, count, raw=False):
+    """
+    Synthetic replacements for the psutil, pysensors and Xlib backed sensors:
+    two out of three are numeric readings, every third one is a text value.
+    raw readings are not rounded, like values read from sysfs and divided.
+    """
+    sensors = []
+    for i in range(count):
+        if i % 3 == 2:
+            values = ["firefox - firefox (running)", "code - code (sleeping)"]
+            func = lambda values=values: random.choice(values)
+            template = "{{ value }}"
+        elif raw:
+            func = lambda: random.uniform(0, 100)
+            template = "{{ value | float | round(1) }}"
+        else:
+            func = lambda: round(random.uniform(0, 100), 1)
+            template = "{{ value | float | round(1) }}"
+        sensors.append(MQTTSensor(f"synthetic_{i}", f"{publish_topic}/synthetic_{i}", "", template, func, f"S{i}"))
+    return sensors
+
+
+def make_host_sensors(directory, count, **sensor_options):
+    config = write_config(directory, default_sections(**sensor_options)).snapshot()
+    runtime = SimpleNamespace(mqtt_client=None)
+    host_sensors = HostSensors(config, runtime)
+    host_sensors.sensors = synthetic_sensors(host_sensors.publish_topic, count)
+    return host_sensors
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        # ru_maxrss is the peak RSS in KiB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentiles(samples):
+    if len(samples) < 2:
+        return {"p50": samples[0], "p95": samples[0], "p99": samples[0]} if samples else {}
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {"p50": cuts[49], "p95": cuts[94], "p99": cuts[98]}
+
+
+def bench_batch(count, intervals):
+    print(f"{count} sensors, {intervals} intervals")
+    print(f"{'mode':<12}{'publishes/interval':>20}{'bytes/interval':>16}")
+    with tempfile.TemporaryDirectory() as directory:
+        for mode, batch in (("per-sensor", False), ("batch", True)):
+            random.seed(1)
+            host_sensors = make_host_sensors(directory, count, batch=batch)
+            client = FakeMQTTClient()
+            for _ in range(intervals):
+                host_sensors.update_mqtt(client)
+                host_sensors.collector.drain()
+            print(f"{mode:<12}{client.publishes / intervals:>20.1f}{client.bytes / intervals:>16.1f}")
+
+
+def bench_load(sensor_count, button_count, ticks, batch):
+    """
+    Runs full update cycles of all consumers and reports per tick latency,
+    throughput, bytes on the wire, CPU time and memory.
+    """
+    random.seed(1)
+    with tempfile.TemporaryDirectory() as directory:
+        config = write_config(directory, default_sections(batch=batch))
+        app = BenchLinux2MQTT(config)
+    host_sensors = next(c for c in app.consumers if isinstance(c, HostSensors))
+    commands = next(c for c in app.consumers if isinstance(c, LinuxCommands))
+    host_sensors.sensors = synthetic_sensors(host_sensors.publish_topic, sensor_count)
+    presses = []
+    for i in range(button_count):
+        topic = f"{commands.subtopic}/bench_{i}"
+        commands.buttons.append(MQTTButton(f"bench_{i}", topic, "mdi:gesture-tap", lambda i=i: presses.append(i)))
+    app.update_discovery()
+
+    rss_before = rss_bytes()
+    app._mqtt_connect()
+    client = app.mqtt_client
+    client.keep_messages = False
+    print(f"{sensor_count} sensors, {button_count} buttons, {ticks} ticks, {'batch' if batch else 'per-sensor'} mode")
+    print(f"discovery: {client.publishes} publishes, {client.bytes} bytes")
+    client.reset()
+    # Reconnecting to a broker that still has the retained configs
+    app._on_mqtt_connect(client, None, {}, 0)
+    print(f"discovery on reconnect: {client.publishes} publishes, {client.bytes} bytes")
+    client.reset()
+
+    tick_times = []
+    press_times = []
+    button_topics = [button.command_topic for button in commands.buttons]
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    for _ in range(ticks):
+        start = time.perf_counter()
+        for consumer in app.consumers:
+            consumer.update_mqtt(client)
+        # Sensor values are published from the worker threads, a tick ends when all of them are done
+        host_sensors.collector.drain()
+        tick_times.append(time.perf_counter() - start)
+        if button_topics:
+            start = time.perf_counter()
+            client.deliver(random.choice(button_topics), "press")
+            press_times.append(time.perf_counter() - start)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    for name, samples in (("tick", tick_times), ("button press", press_times)):
+        if samples:
+            stats = ", ".join(f"{k} {v * 1000:.3f} ms" for k, v in percentiles(samples).items())
+            print(f"{name} latency: {stats}")
+    print(f"publishes: {client.publishes / ticks:.1f}/tick, {client.publishes / wall:.0f}/s")
+    print(f"bytes on the wire: {client.bytes / ticks:.0f}/tick, {client.bytes / wall / 1024:.1f} KiB/s")
+    print(f"cpu time: {cpu / ticks * 1000:.3f} ms/tick ({cpu / wall * 100:.0f}% of wall time)")
+    print(f"rss: {rss_bytes() / 2**20:.1f} MiB ({(rss_bytes() - rss_before) / 2**20:+.1f} MiB)")
+    host_sensors.collector.shutdown()
+
+
+def bench_v5(count, intervals):
+    """
+    Compares the bytes on the wire of the state messages with MQTT 3.1.1, MQTT 5 with
+    topic aliases, and MQTT 5 with topic aliases and values rounded to one decimal.
+    """
+    print(f"{count} sensors with unrounded readings, {intervals} intervals")
+    print(f"{'mode':<32}{'bytes/interval':>16}{'saved':>8}")
+    baseline = None
+    for mode, mqtt_options, precision in (
+        ("MQTT 3.1.1", {}, None),
+        ("MQTT 5, topic aliases", {"protocol": 5}, None),
+        ("MQTT 5, topic aliases, 1 decimal", {"protocol": 5}, 1),
+    ):
+        random.seed(1)
+        sections = default_sections()
+        sections["mqtt"].update(mqtt_options)
+        with tempfile.TemporaryDirectory() as directory:
+            app = BenchLinux2MQTT(write_config(directory, sections))
+        host_sensors = next(c for c in app.consumers if isinstance(c, HostSensors))
+        host_sensors.sensors = synthetic_sensors(host_sensors.publish_topic, count, raw=True)
+        for sensor in host_sensors.sensors:
+            sensor.precision = precision
+        app._mqtt_connect()
+        client = app.mqtt_client
+        client.keep_messages = False
+        client.reset()
+        for _ in range(intervals):
+            host_sensors.update_mqtt(app.publisher)
+            host_sensors.collector.drain()
+        per_interval = client.bytes / intervals
+        baseline = baseline or per_interval
+        print(f"{mode:<32}{per_interval:>16.1f}{(1 - per_interval / baseline) * 100:>7.0f}%")
+        host_sensors.collector.shutdown()
+
+
+def bench_startup():
+    """
+    Measures the time from creating the daemon to the first value handed to the MQTT client,
+    with the /proc based sensors and a broker that becomes reachable right away.
+    """
+    sections = default_sections(cpu_usage=True, memory=True, load=True, disks=True, network=True)
+    with tempfile.TemporaryDirectory() as directory:
+        settings = write_config(directory, sections)
+        app = BenchLinux2MQTT(settings)
+    app._mqtt_connect()
+    client = app.mqtt_client
+    host_sensors = next(c for c in app.consumers if isinstance(c, HostSensors))
+    while app.first_publish is None:
+        app.scheduler.run_pending(app.publisher)
+        host_sensors.collector.drain()
+    print(f"{len(host_sensors.sensors)} sensors, {client.publishes} publishes")
+    print(f"time to first publish: {app.first_publish * 1000:.1f} ms")
+    optional = [name for name in ("sensors", "Xlib", "psutil") if name in sys.modules]
+    print(f"optional backends imported: {', '.join(optional) or 'none'}")
+    for consumer in app.consumers:
+        consumer.close()
+
+
+def write_fake_sysfs(root, packages):
+    """
+    Creates a fake /sys with RAPL package, core and dram domains, a battery and an AC adapter.
+    Returns the energy_uj files, which are advanced by the benchmark.
+    """
+    files = {}
+
+    def write(path, value):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(f"{value}\n")
+
+    for package in range(packages):
+        for suffix, name in (("", f"package-{package}"), (":0", "core"), (":1", "dram")):
+            directory = f"{root}/class/powercap/intel-rapl:{package}{suffix}"
+            write(f"{directory}/name", name)
+            write(f"{directory}/max_energy_range_uj", 262143328850)
+            write(f"{directory}/energy_uj", 262143328850 - 20000000)
+            files[f"{directory}/energy_uj"] = 262143328850 - 20000000
+    for name, values in (
+        ("BAT0", {"type": "Battery", "capacity": 87, "status": "Discharging", "power_now": 9123000}),
+        ("AC", {"type": "Mains", "online": 0}),
+    ):
+        for attribute, value in values.items():
+            write(f"{root}/class/power_supply/{name}/{attribute}", value)
+    return files
+
+
+def bench_power(packages, ticks):
+    """
+    Reads RAPL domains and power supplies from a fake sysfs tree. The energy counters
+    start right below max_energy_range_uj, so the first ticks cross the wraparound.
+    Reports the syscalls per tick, which do not include any open or directory scan.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        energy_files = write_fake_sysfs(directory, packages)
+        sections = default_sections()
+        sections["power"] = {"enable": True, "root": directory}
+        app = BenchLinux2MQTT(write_config(directory, sections))
+        power = next(c for c in app.consumers if isinstance(c, PowerSensors))
+        # One second between two refreshes, every domain uses 15 W
+        now = 0.0
+        power.tree.clock = lambda: now
+        client = FakeMQTTClient()
+        reads = 0
+        pread = os.pread
+
+        def counting_pread(*args):
+            nonlocal reads
+            reads += 1
+            return pread(*args)
+
+        elapsed = 0.0
+        for _ in range(ticks):
+            now += 1.0
+            for path in energy_files:
+                energy_files[path] = (energy_files[path] + 15000000) % 262143328850
+                with open(path, "w") as f:
+                    f.write(f"{energy_files[path]}\n")
+            os.pread = counting_pread
+            start = time.perf_counter()
+            power.update_mqtt(client)
+            power.collector.drain()
+            elapsed += time.perf_counter() - start
+            os.pread = pread
+        values = {topic.rsplit("/", 1)[-1]: payload.decode() for topic, payload, _ in client.messages}
+        watts = [float(payload) for topic, payload, _ in client.messages if "/rapl_" in topic]
+        power.close()
+    failures = []
+    # Every tick after the first has a rate, the second one crosses the wraparound
+    if len(watts) != packages * 3 * (ticks - 1) or any(w != 15.0 for w in watts):
+        failures.append(f"{len(watts)} RAPL values from {min(watts, default=None)} to {max(watts, default=None)} W")
+    for key, expected in (
+        ("power_supply_bat0_capacity", "87"),
+        ("power_supply_bat0_status", "Discharging"),
+        ("power_supply_bat0_power", "9.12"),
+        ("power_supply_ac_online", "OFF"),
+    ):
+        if values.get(key) != expected:
+            failures.append(f"{key}: {values.get(key)}, expected {expected}")
+    print(f"{len(power.sensors)} sensors from {packages * 3} RAPL domains and 2 power supplies, {ticks} ticks")
+    print(f"preads: {reads / ticks:.1f}/tick, {elapsed / ticks * 1000:.3f} ms/tick")
+    for failure in failures:
+        print(f"FAILED {failure}")
+    if failures:
+        sys.exit(1)
+    print("15 W across the wraparound and power supply values ok")
+
+
+def write_fake_cgroup(root, path, usage_usec, memory, rbytes, wbytes):
+    directory = f"{root}/{path}"
+    os.makedirs(directory, exist_ok=True)
+    for name, content in (
+        ("cpu.stat", f"usage_usec {usage_usec}\nuser_usec {usage_usec}\nsystem_usec 0\n"),
+        ("memory.current", f"{memory}\n"),
+        ("io.stat", f"8:0 rbytes={rbytes} wbytes={wbytes} rios=0 wios=0 dbytes=0 dios=0\n"),
+    ):
+        # Written in place, the kept-open files see the new content like the kernel's attribute files
+        with open(f"{directory}/{name}", "r+" if os.path.exists(f"{directory}/{name}") else "w") as f:
+            f.write(content)
+            f.truncate()
+
+
+def bench_cgroups(count, ticks):
+    """
+    Reads the statistics of services from a fake cgroup v2 tree through CgroupSensors.
+    Service i uses (i + 1) % of a CPU, reads 1000 kB/s, writes 500 kB/s and holds i + 1 MiB.
+    Checks the published values, then removes one service and starts another one and checks
+    that the rescan picks up both. Fails if a value is wrong.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        root = f"{directory}/cgroup"
+
+        def write(i, tick):
+            path = f"system.slice/unit{i}.service"
+            write_fake_cgroup(root, path, (i + 1) * 10000 * tick, (i + 1) * 2**20, 10**6 * tick, 5 * 10**5 * tick)
+
+        for i in range(count):
+            write(i, 0)
+        sections = default_sections()
+        sections["cgroups"] = {"enable": True, "root": root}
+        app = BenchLinux2MQTT(write_config(directory, sections))
+        cgroups = next(c for c in app.consumers if isinstance(c, CgroupSensors))
+        tree = cgroups.tree
+        # One second between two refreshes, starting after the baseline taken by the first scan
+        now = time.monotonic()
+        tree.clock = lambda: now
+        client = FakeMQTTClient()
+        reads = 0
+        pread = os.pread
+
+        def counting_pread(*args):
+            nonlocal reads
+            reads += 1
+            return pread(*args)
+
+        elapsed = 0.0
+        for tick in range(1, ticks + 1):
+            now += 1.0
+            for i in range(count):
+                write(i, tick)
+            os.pread = counting_pread
+            start = time.perf_counter()
+            cgroups.update_mqtt(client)
+            cgroups.collector.drain()
+            elapsed += time.perf_counter() - start
+            os.pread = pread
+        values = {topic: float(payload) for topic, payload, _ in client.messages}
+        failures = []
+        for i in range(count):
+            topic = f"{cgroups.publish_topic}/system_slice_unit{i}_service"
+            for suffix, expected in (("cpu", i + 1.0), ("memory", i + 1.0), ("io_read", 1000.0), ("io_write", 500.0)):
+                if values.get(f"{topic}/{suffix}") != expected:
+                    failures.append(f"unit{i}.service {suffix}: {values.get(f'{topic}/{suffix}')}, expected {expected}")
+        shutil.rmtree(f"{root}/system.slice/unit0.service")
+        write_fake_cgroup(root, "system.slice/new.service", 0, 2**20, 0, 0)
+        cgroups.rescan(client)
+        paths = tree.paths()
+        if "system.slice/unit0.service" in paths or "system.slice/new.service" not in paths:
+            failures.append(f"rescan found {paths}")
+        if len(cgroups.sensors) != 4 * count:
+            failures.append(f"{len(cgroups.sensors)} sensors after the rescan, expected {4 * count}")
+        cgroups.close()
+    print(f"{count} cgroups, {4 * count} sensors, {ticks} ticks")
+    print(f"preads: {reads / ticks:.1f}/tick, {elapsed / ticks * 1000:.3f} ms/tick")
+    for failure in failures:
+        print(f"FAILED {failure}")
+    if failures:
+        sys.exit(1)
+    print("values and rescan ok")
+
+
+def bench_resume():
+    """
+    Suspends and resumes on simulated clocks, with and without logind's PrepareForSleep
+    signals in either order, and checks that every suspend is handled exactly once.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        app = BenchLinux2MQTT(write_config(directory, default_sections()))
+    app._mqtt_connect()
+    clocks = {"boottime": 1000.0, "monotonic": 500.0}
+    resumes = []
+    app.on_resume = lambda: resumes.append(clocks["boottime"])
+
+    def run(scenario, steps, expected):
+        app.suspend_detector = SuspendDetector(
+            boottime=lambda: clocks["boottime"], monotonic=lambda: clocks["monotonic"]
+        )
+        resumes.clear()
+        for step in steps:
+            if step == "sleep":
+                app.on_suspend()
+            elif step == "wake":
+                app.check_resume(True)
+            elif step == "poll":
+                app.check_resume()
+            else:
+                # Time passes, only the boot time advances while suspended
+                clocks["boottime"] += step[1]
+                if step[0] == "run":
+                    clocks["monotonic"] += step[1]
+        result = "ok" if len(resumes) == expected else "FAILED"
+        print(f"{scenario:<40}{len(resumes):>8}{expected:>10}  {result}")
+        return len(resumes) == expected
+
+    print(f"{'scenario':<40}{'resumes':>8}{'expected':>10}")
+    passed = all(
+        [
+            run("running, no suspend", [("run", 60), "poll", ("run", 60), "poll"], 0),
+            run("suspend, clocks only", [("suspended", 600), "poll", "poll"], 1),
+            run("logind, clocks noticed first", ["sleep", ("suspended", 600), "poll", "wake", "poll"], 1),
+            run("logind, wake signal first", ["sleep", ("suspended", 600), "wake", "poll"], 1),
+            run("logind, shorter than the threshold", ["sleep", ("suspended", 1), "wake", "poll"], 1),
+            run("two suspends", ["sleep", ("suspended", 60), "poll", "wake", "sleep", ("suspended", 60), "wake"], 2),
+        ]
+    )
+    if not passed:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    batch_parser = subparsers.add_parser("batch", help="compare per-sensor and batch publishing")
+    batch_parser.add_argument("--sensors", type=int, default=8, help="number of synthetic sensors")
+    batch_parser.add_argument("--intervals", type=int, default=100, help="number of update intervals")
+    load_parser = subparsers.add_parser("load", help="run full update cycles against a fake broker")
+    load_parser.add_argument("--sensors", type=int, default=200, help="number of synthetic sensors")
+    load_parser.add_argument("--buttons", type=int, default=100, help="number of synthetic buttons")
+    load_parser.add_argument("--ticks", type=int, default=200, help="number of update cycles")
+    load_parser.add_argument("--batch", action="store_true", help="publish all sensors as one JSON document")
+    v5_parser = subparsers.add_parser("v5", help="compare MQTT 3.1.1 and MQTT 5 with topic aliases")
+    v5_parser.add_argument("--sensors", type=int, default=30, help="number of synthetic sensors")
+    v5_parser.add_argument("--intervals", type=int, default=100, help="number of update intervals")
+    subparsers.add_parser("startup", help="measure the time to the first publish")
+    power_parser = subparsers.add_parser("power", help="read RAPL and power supplies from a fake sysfs tree")
+    power_parser.add_argument("--packages", type=int, default=2, help="number of RAPL packages")
+    power_parser.add_argument("--ticks", type=int, default=100, help="number of update cycles")
+    subparsers.add_parser("resume", help="check resume detection on simulated clocks")
+    cgroups_parser = subparsers.add_parser("cgroups", help="read cgroups from a fake cgroup v2 tree")
+    cgroups_parser.add_argument("--cgroups", type=int, default=20, help="number of services")
+    cgroups_parser.add_argument("--ticks", type=int, default=100, help="number of update cycles")
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    if args.benchmark == "batch":
+        bench_batch(args.sensors, args.intervals)
+    elif args.benchmark == "v5":
+        bench_v5(args.sensors, args.intervals)
+    elif args.benchmark == "startup":
+        bench_startup()
+    elif args.benchmark == "power":
+        bench_power(args.packages, args.ticks)
+    elif args.benchmark == "resume":
+        bench_resume()
+    elif args.benchmark == "cgroups":
+        bench_cgroups(args.cgroups, args.ticks)
+    else:
+        bench_load(args.sensors, args.buttons, args.ticks, args.batch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+from __future__ import annotations
+import re
+from typing import TYPE_CHECKING, List
+
+from loguru import logger
+
+from host_sensors import MQTTSensor, SensorConsumer
+from scheduler import ScheduledTask
+from cgroupfs import CgroupTree
+
+if TYPE_CHECKING:
+    from settings import Config
+    from main import Linux2MQTT
+
+DEFAULT_INCLUDE = "system.slice/*.service"
+# Time in seconds between scans of the cgroup tree for added and removed cgroups
+DEFAULT_RESCAN_INTERVAL = 60.0
+
+
+class CgroupSensors(SensorConsumer):
+    """
+    Publishes CPU, memory and I/O usage of systemd units and containers from the cgroup v2 hierarchy.
+    """
+
+    config_sections = ("cgroups",)
+    # All sensors share one refresh of the tree
+    default_workers = 1
+
+    def __init__(self, config: Config, runtime: Linux2MQTT):
+        super().__init__(config, runtime, "cgroups")
+        self.sensors: List[MQTTSensor] = []
+        self.paths: List[str] = []
+        self.tree = None
+        self.client_name = config.client_name
+        self.publish_topic = config.topic("cgroups", "cgroups")
+        options = self.options
+        self.enabled = options.getbool("enable")
+        if not self.enabled:
+            return
+        self.interval = options.getfloat("update_interval", positive=True)
+        self.rescan_interval = options.getfloat("rescan_interval", DEFAULT_RESCAN_INTERVAL, positive=True)
+        self.tree = CgroupTree(
+            options.get("root", "/sys/fs/cgroup"),
+            options.get("include", DEFAULT_INCLUDE),
+            options.get("exclude", ""),
+            options.getint("max_depth", 3),
+        )
+        self.tree.scan()
+        self._update_sensors()
+        self._start_collector()
+        logger.info(f"Publishing usage of {len(self.paths)} cgroups to {self.publish_topic}")
+
+    def _update_sensors(self) -> bool:
+        paths = self.tree.paths()
+        if paths == self.paths:
+            return False
+        self.paths = paths
+        sensors = []
+        for path in paths:
+            key = re.sub(r"\W", "_", path)
+            # The unit or container name without the slices it is in
+            name = path.rsplit("/", 1)[-1]
+            for suffix, unit, func, label, device_class in (
+                ("cpu", "%", CgroupTree.cpu_percent, "CPU Usage", None),
+                ("memory", "MiB", CgroupTree.memory_mib, "Memory", "data_size"),
+                ("io_read", "kB/s", CgroupTree.io_read, "Disk Read", "data_rate"),
+                ("io_write", "kB/s", CgroupTree.io_write, "Disk Write", "data_rate"),
+            ):
+                sensor = MQTTSensor(
+                    f"cgroup_{key}_{suffix}",
+                    f"{self.publish_topic}/{key}/{suffix}",
+                    unit,
+                    "{{ value }}",
+                    # The first sensor read in a tick refreshes all cgroups, the others take their values from it
+                    lambda path=path, func=func: self.tree.get(lambda tree: func(tree, path)),
+                    f"{self.client_name.title()} {name} {label}",
+                    device_class=device_class,
+                )
+                self._setup_sensor(sensor)
+                sensors.append(sensor)
+        self.sensors = sensors
+        return True
+
+    def rescan(self, mqtt_client):
+        self.tree.scan()
+        if self._update_sensors():
+            logger.info(f"Cgroups changed, publishing usage of {len(self.paths)} cgroups")
+            self.runtime.refresh_discovery()
+
+    def scheduled_tasks(self):
+        if not self.enabled:
+            return []
+        return [
+            ScheduledTask("cgroups", self.interval, self.update_mqtt),
+            ScheduledTask("cgroups:rescan", self.rescan_interval, self.rescan),
+        ]
+
+    def close(self):
+        super().close()
+        if self.tree is not None:
+            self.tree.close()
+            self.tree = None
@@ -0,0 +1,169 @@
+import os
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sysfs import CachedSnapshot, SysfsFile, open_optional
+from throughput import CounterRates, DeviceFilter
+
+
+@dataclass
+class Cgroup:
+    path: str
+    # A cgroup that is removed and created again with the same name gets a new inode
+    inode: int
+    cpu_stat: Optional[SysfsFile] = None
+    memory_current: Optional[SysfsFile] = None
+    io_stat: Optional[SysfsFile] = None
+    memory: Optional[int] = None
+
+    @property
+    def key(self) -> Tuple[str, int]:
+        return self.path, self.inode
+
+    def close(self):
+        for file in (self.cpu_stat, self.memory_current, self.io_stat):
+            if file is not None:
+                file.close()
+
+
+class CgroupTree(CachedSnapshot):
+    """
+    Reads CPU, memory and I/O statistics of the selected cgroups of a cgroup v2 hierarchy.
+    The tree is only scanned every rescan interval. The statistics files of every selected
+    cgroup are kept open, so a refresh costs three preads per cgroup. Cgroups that disappear
+    are dropped as soon as reading them fails or the next scan does not find them.
+    Rates are (CPU usage in percent of one CPU, read bytes/s, written bytes/s).
+    """
+
+    def __init__(
+        self,
+        root: str = "/sys/fs/cgroup",
+        include: str = "system.slice/*.service",
+        exclude: str = "",
+        max_depth: int = 3,
+        max_age: float = 0.5,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.root = root.rstrip("/")
+        self.filter = DeviceFilter(include, exclude)
+        self.max_depth = max_depth
+        super().__init__(max_age, clock)
+        self.cgroups: Dict[str, Cgroup] = {}
+        self.rates = CounterRates()
+
+    def _walk(self, directory: str, depth: int, found: Dict[str, int], visited: List[bytes]):
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            # Removed while scanning
+            return
+        for entry in entries:
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            path = entry.path[len(self.root) + 1 :]
+            visited.append(path.encode())
+            if self.filter(visited[-1]):
+                found[path] = entry.inode()
+            if depth < self.max_depth:
+                self._walk(entry.path, depth + 1, found, visited)
+
+    def scan(self) -> bool:
+        """
+        Looks for added and removed cgroups. Returns True if the selection changed.
+        """
+        found: Dict[str, int] = {}
+        visited: List[bytes] = []
+        self._walk(self.root, 1, found, visited)
+        self.filter.retain(visited)
+        with self.lock:
+            changed = False
+            for path, cgroup in list(self.cgroups.items()):
+                if found.get(path) != cgroup.inode:
+                    cgroup.close()
+                    del self.cgroups[path]
+                    changed = True
+            for path, inode in found.items():
+                if path in self.cgroups:
+                    continue
+                directory = f"{self.root}/{path}"
+                # A file is None if its controller is not enabled for this cgroup
+                self.cgroups[path] = Cgroup(
+                    path,
+                    inode,
+                    open_optional(f"{directory}/cpu.stat", 1024),
+                    open_optional(f"{directory}/memory.current", 64),
+                    open_optional(f"{directory}/io.stat", 1024),
+                )
+                changed = True
+            if changed:
+                # Start with a fresh baseline, so new cgroups have rates after the next refresh
+                self.refresh()
+        return changed
+
+    @staticmethod
+    def _read_cpu(cgroup: Cgroup) -> int:
+        # The first line is usage_usec
+        line = cgroup.cpu_stat.read().split(b"\n", 1)[0]
+        return int(line.split()[1])
+
+    @staticmethod
+    def _read_io(cgroup: Cgroup) -> Tuple[int, int]:
+        read = written = 0
+        # One line per device: 8:0 rbytes=... wbytes=... rios=... wios=... dbytes=... dios=...
+        for line in cgroup.io_stat.read().split(b"\n"):
+            for item in line.split()[1:]:
+                key, _, value = item.partition(b"=")
+                if key == b"rbytes":
+                    read += int(value)
+                elif key == b"wbytes":
+                    written += int(value)
+        return read, written
+
+    def refresh(self):
+        # Called with the lock held
+        counters = {}
+        for path, cgroup in list(self.cgroups.items()):
+            try:
+                cpu = self._read_cpu(cgroup) if cgroup.cpu_stat is not None else 0
+                read, written = self._read_io(cgroup) if cgroup.io_stat is not None else (0, 0)
+                cgroup.memory = cgroup.memory_current.read_int() if cgroup.memory_current is not None else None
+            except (OSError, ValueError, IndexError):
+                # The cgroup was removed, the files of a removed cgroup return ENODEV
+                cgroup.close()
+                del self.cgroups[path]
+                continue
+            counters[cgroup.key] = (cpu, read, written)
+        self.rates.update(counters, self.clock())
+        self.refreshed = self.clock()
+
+    def paths(self) -> List[str]:
+        return sorted(self.cgroups)
+
+    def _rates(self, path: str) -> Optional[Tuple[float, ...]]:
+        cgroup = self.cgroups.get(path)
+        return None if cgroup is None else self.rates.rates.get(cgroup.key)
+
+    def cpu_percent(self, path: str) -> Optional[float]:
+        rates = self._rates(path)
+        # usage_usec per second, in percent of one CPU
+        return None if rates is None or self.cgroups[path].cpu_stat is None else round(rates[0] / 10**4, 1)
+
+    def memory_mib(self, path: str) -> Optional[float]:
+        cgroup = self.cgroups.get(path)
+        return None if cgroup is None or cgroup.memory is None else round(cgroup.memory / 2**20, 1)
+
+    def io_read(self, path: str) -> Optional[float]:
+        # In kB/s
+        rates = self._rates(path)
+        return None if rates is None or self.cgroups[path].io_stat is None else round(rates[1] / 1000, 1)
+
+    def io_write(self, path: str) -> Optional[float]:
+        rates = self._rates(path)
+        return None if rates is None or self.cgroups[path].io_stat is None else round(rates[2] / 1000, 1)
+
+    def close(self):
+        with self.lock:
+            for cgroup in self.cgroups.values():
+                cgroup.close()
+            self.cgroups = {}
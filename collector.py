@@ -0,0 +1,285 @@
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import Future, wait
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+# Backoff for failing sensors, doubled on every consecutive failure
+BACKOFF_BASE = 5.0
+BACKOFF_MAX = 300.0
+
+
+@dataclass
+class _SensorState:
+    future: Optional[Future] = None
+    started: float = 0.0
+    failures: int = 0
+    next_attempt: float = 0.0
+    timed_out: bool = False
+    timeout: float = 0.0
+    # A replacement worker was started while this read was stuck
+    replaced: bool = False
+
+
+class _Batch:
+    """
+    The reads of one SensorCollector.collect() call.
+    """
+
+    def __init__(self, futures: Dict[str, Future], callback: Callable[[Dict], None], deadline: float):
+        self.futures = futures
+        self.callback = callback
+        self.deadline = deadline
+        self.remaining = len(futures)
+        self.lock = threading.Lock()
+        # Set once the callback has run
+        self.done = threading.Event()
+
+    def finish(self) -> bool:
+        """
+        Calls the callback with the values read so far, unless that already happened. Returns True if it did.
+        """
+        with self.lock:
+            if self.done.is_set():
+                return False
+            values = {}
+            for name, future in self.futures.items():
+                if future.done() and future.exception() is None and future.result() is not None:
+                    values[name] = future.result()
+            try:
+                self.callback(values)
+            except Exception as e:
+                logger.error(f"Error handling collected sensor values: {e}")
+            self.done.set()
+        return True
+
+
+class SensorCollector:
+    """
+    Reads sensor values on a bounded pool of worker threads.
+    A read that takes longer than its timeout is dropped for that cycle, and
+    the sensor is not read again while the previous read is still running.
+    Sensors that time out or raise are retried with an exponential backoff.
+    A worker stuck in a read is replaced by a new one, so a few hanging sensors cannot
+    starve the others, and the pool shrinks back once the stuck read returns.
+    The workers are daemon threads, so a hung read never blocks shutdown.
+    """
+
+    def __init__(self, max_workers: int = 4, timeout: float = 10.0, clock: Callable[[], float] = time.monotonic):
+        self.timeout = timeout
+        self.clock = clock
+        self.states: Dict[str, _SensorState] = {}
+        # Duration of the last finished read of every sensor
+        self.durations: Dict[str, float] = {}
+        # Reads that were submitted and have not finished, including their callbacks. A cycle lasts from
+        # the first submit while nothing is in flight until the last read of it finished.
+        self.in_flight = 0
+        self.cycle_started = 0.0
+        self.cycle_duration = 0.0
+        self.lock = threading.Lock()
+        self.queue = queue.SimpleQueue()
+        # Reads currently running on a worker
+        self.active: Dict[str, _SensorState] = {}
+        # Number of workers to retire because their stuck read was replaced and has returned
+        self.surplus = 0
+        # The live workers, retired ones remove themselves
+        self.workers: List[threading.Thread] = []
+        self.worker_ids = itertools.count()
+        # collect() calls whose callback has not run yet, finished by the deadline thread if a read hangs
+        self.batches: List[_Batch] = []
+        self.deadline_thread = None
+        self.deadline_wakeup = threading.Event()
+        self.closed = False
+        for _ in range(max_workers):
+            self._start_worker()
+
+    def _start_worker(self):
+        worker = threading.Thread(target=self._worker, name=f"sensor-{next(self.worker_ids)}", daemon=True)
+        self.workers.append(worker)
+        worker.start()
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            future, func, args = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func(*args))
+            except BaseException as e:
+                future.set_exception(e)
+            with self.lock:
+                if self.surplus:
+                    self.surplus -= 1
+                    self.workers.remove(threading.current_thread())
+                    return
+
+    def _check_stuck(self, now: float):
+        # Called with the lock held
+        for name, state in self.active.items():
+            if not state.timed_out and now - state.started > state.timeout:
+                state.timed_out = True
+                self._failed(name, state, f"timed out after {state.timeout} s")
+            if state.timed_out and not state.replaced:
+                state.replaced = True
+                self._start_worker()
+                # A stuck read does not hold the cycle open
+                self._read_done()
+
+    def _read_done(self):
+        # Called with the lock held
+        self.in_flight -= 1
+        if self.in_flight == 0:
+            self.cycle_duration = self.clock() - self.cycle_started
+
+    def submit(self, name: str, func: Callable, callback: Callable = None, timeout: float = None) -> Optional[Future]:
+        """
+        Starts reading a sensor unless it is backing off or still busy with the previous read.
+        The callback is called from the worker thread with the value if the read finished in time.
+        The returned future resolves to the value, or None if the read failed or timed out.
+        """
+        timeout = timeout or self.timeout
+        now = self.clock()
+        with self.lock:
+            self._check_stuck(now)
+            state = self.states.setdefault(name, _SensorState())
+            if state.future is not None and not state.future.done():
+                if now - state.started > timeout and not state.timed_out:
+                    state.timed_out = True
+                    self._failed(name, state, f"timed out after {timeout} s")
+                return None
+            if now < state.next_attempt:
+                return None
+            state.started = now
+            state.timeout = timeout
+            state.timed_out = False
+            state.future = Future()
+            if self.in_flight == 0:
+                self.cycle_started = now
+            self.in_flight += 1
+        self.queue.put((state.future, self._read, (name, state, func, callback, timeout)))
+        return state.future
+
+    def _read(self, name, state: _SensorState, func, callback, timeout):
+        with self.lock:
+            self.active[name] = state
+        try:
+            return self._read_value(name, state, func, callback, timeout)
+        finally:
+            with self.lock:
+                self._finished(name, state)
+
+    def _read_value(self, name, state: _SensorState, func, callback, timeout):
+        try:
+            value = func()
+        except Exception as e:
+            with self.lock:
+                self._failed(name, state, f"failed: {e}")
+            return None
+        with self.lock:
+            elapsed = self.clock() - state.started
+            self.durations[name] = elapsed
+            if elapsed > timeout:
+                if not state.timed_out:
+                    state.timed_out = True
+                    self._failed(name, state, f"timed out after {timeout} s")
+                return None
+            state.failures = 0
+            state.next_attempt = 0.0
+        if callback is not None:
+            try:
+                callback(value)
+            except Exception as e:
+                logger.error(f"Error handling value of sensor {name}: {e}")
+        return value
+
+    def _finished(self, name, state: _SensorState):
+        # Called with the lock held
+        self.active.pop(name, None)
+        if state.replaced:
+            # A replacement was started while this read was stuck, one worker is now too many
+            state.replaced = False
+            self.surplus += 1
+        else:
+            self._read_done()
+
+    def _failed(self, name, state: _SensorState, reason):
+        # Called with the lock held
+        state.failures += 1
+        backoff = min(BACKOFF_BASE * 2 ** (state.failures - 1), BACKOFF_MAX)
+        state.next_attempt = self.clock() + backoff
+        logger.warning(f"Sensor {name} {reason}, retrying in {backoff:.0f} s")
+
+    def collect(self, reads: List[Tuple[str, Callable, Optional[float]]], callback: Callable[[Dict], None]):
+        """
+        Reads several sensors concurrently without waiting for them. Once all of them finished,
+        or the longest timeout passed, callback is called with the values of the sensors that could
+        be read, from the thread of the last read or from the deadline thread.
+        """
+        futures = {name: self.submit(name, func, None, timeout) for name, func, timeout in reads}
+        futures = {name: future for name, future in futures.items() if future is not None}
+        longest = max((timeout or self.timeout for _, _, timeout in reads), default=0.0)
+        batch = _Batch(futures, callback, self.clock() + longest)
+        if not futures:
+            batch.finish()
+            return
+        with self.lock:
+            self.batches.append(batch)
+            if self.deadline_thread is None:
+                self.deadline_thread = threading.Thread(target=self._deadlines, name="sensor-deadlines", daemon=True)
+                self.deadline_thread.start()
+            self.deadline_wakeup.set()
+        for future in futures.values():
+            future.add_done_callback(lambda future: self._batch_read_done(batch))
+
+    def _batch_read_done(self, batch: "_Batch"):
+        with batch.lock:
+            batch.remaining -= 1
+            if batch.remaining:
+                return
+        self._finish_batch(batch)
+
+    def _finish_batch(self, batch: "_Batch"):
+        if batch.finish():
+            with self.lock:
+                self.batches.remove(batch)
+
+    def _deadlines(self):
+        # Finishes the batches whose reads are not all done by their deadline, one thread for all of them
+        while True:
+            with self.lock:
+                if self.closed:
+                    return
+                now = self.clock()
+                expired = [batch for batch in self.batches if batch.deadline <= now]
+                upcoming = min((batch.deadline for batch in self.batches if batch.deadline > now), default=None)
+                self.deadline_wakeup.clear()
+            for batch in expired:
+                self._finish_batch(batch)
+            self.deadline_wakeup.wait(None if upcoming is None else upcoming - now)
+
+    def drain(self, timeout: float = None):
+        """
+        Waits until all running reads, including their callbacks and those of collect(), have finished.
+        """
+        with self.lock:
+            running = [state.future for state in self.states.values() if state.future is not None]
+        wait(running, timeout=timeout)
+        with self.lock:
+            batches = list(self.batches)
+        for batch in batches:
+            batch.done.wait(timeout)
+
+    def shutdown(self):
+        with self.lock:
+            self.closed = True
+            self.deadline_wakeup.set()
+            workers = len(self.workers)
+        for _ in range(workers):
+            self.queue.put(None)
@@ -0,0 +1,110 @@
+import os
+import queue
+import signal
+import subprocess
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional, Set
+
+from loguru import logger
+
+# Output beyond this is cut off, so a chatty command does not produce huge MQTT messages
+MAX_OUTPUT = 4096
+
+
+@dataclass
+class CommandResult:
+    exit_code: Optional[int]
+    output: str
+    duration: float
+    timed_out: bool = False
+
+    def to_dict(self) -> dict:
+        return {
+            "exit_code": self.exit_code,
+            "output": self.output,
+            "duration": round(self.duration, 3),
+            "timed_out": self.timed_out,
+        }
+
+
+class CommandRunner:
+    """
+    Runs shell commands on a bounded pool of worker threads.
+    A command is not started again while it is still queued or running, and it is
+    killed together with all of its children when it exceeds its timeout.
+    The workers are daemon threads, so a running command never blocks shutdown.
+    """
+
+    def __init__(self, max_workers: int = 2, timeout: float = 60.0):
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.busy: Set[str] = set()
+        self.queue = queue.SimpleQueue()
+        self.workers = [
+            threading.Thread(target=self._worker, name=f"command-{i}", daemon=True) for i in range(max_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            name, command, timeout, callback = item
+            try:
+                result = self.run(command, timeout)
+            except OSError as e:
+                result = CommandResult(None, str(e), 0.0)
+            with self.lock:
+                self.busy.discard(name)
+            logger.info(f"Command {name} finished with exit code {result.exit_code} after {result.duration:.1f} s")
+            if callback is not None:
+                try:
+                    callback(result)
+                except Exception as e:
+                    logger.error(f"Error handling result of command {name}: {e}")
+
+    def submit(self, name: str, command: str, callback: Callable = None, timeout: float = None) -> bool:
+        """
+        Queues a command unless it is already queued or running.
+        The callback is called from the worker thread with the CommandResult.
+        """
+        with self.lock:
+            if name in self.busy:
+                logger.warning(f"Command {name} is still running, ignoring request")
+                return False
+            self.busy.add(name)
+        self.queue.put((name, command, timeout or self.timeout, callback))
+        return True
+
+    def run(self, command: str, timeout: float) -> CommandResult:
+        start = time.monotonic()
+        # A new session, so the shell and everything it started can be killed as a group
+        process = subprocess.Popen(
+            command,
+            shell=True,
+            executable="/bin/bash",
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+        timed_out = False
+        try:
+            output, _ = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            timed_out = True
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            output, _ = process.communicate()
+        output = output[-MAX_OUTPUT:].decode(errors="replace")
+        return CommandResult(process.returncode, output, time.monotonic() - start, timed_out)
+
+    def shutdown(self):
+        for _ in self.workers:
+            self.queue.put(None)
@@ -1,19 +1,18 @@
 from __future__ import annotations
 import subprocess
-import time
-import socket
 import json
 from dataclasses import dataclass
-from typing import Callable, TYPE_CHECKING
+from typing import Callable, Dict, TYPE_CHECKING
 
 from loguru import logger
 
 from mqttconsumer import MQTTConsumer
+from command_runner import CommandRunner, CommandResult
 
 PAYLOAD_PRESS = "press"
 
 if TYPE_CHECKING:
-    from settings import Settings
+    from settings import Config
     from main import Linux2MQTT
 
 
@@ -23,39 +22,76 @@ class MQTTButton:
     base_topic: str
     icon: str
     callback: Callable = None
+    # Shell command of a configured command, None for the builtin actions
+    command: str = None
+    timeout: float = None
 
     @property
     def command_topic(self):
         return f"{self.base_topic}/set"
 
+    @property
+    def result_topic(self):
+        return f"{self.base_topic}/result"
+
 
 class LinuxCommands(MQTTConsumer):
-    def __init__(self, config: Settings, runtime: Linux2MQTT):
+    config_sections = ("commands",)
+
+    def __init__(self, config: Config, runtime: Linux2MQTT):
         super().__init__(config, runtime)
         self.config = config
         self.runtime = runtime
-        self.will_suspend = False
-        self.will_poweroff = False
-        self.availability_topic = runtime.availability_topic
-        head_topic = self.config.get("mqtt", "topic", "linux2mqtt")
-        self.client_name = self.config.get("client", "name", socket.gethostname())
-        our_topic = self.config.get("commands", "sub_topic", "commands")
-        self.subtopic = f"{head_topic}/{self.client_name}/{our_topic}"
+        self.availability_topic = config.availability_topic
+        self.client_name = config.client_name
+        self.subtopic = config.topic("commands", "commands")
         self.buttons = []
+        options = config.section("commands")
 
         # Suspend button
-        if self.config.get("commands", "suspend", "false").lower() == "true":
+        if options.getbool("suspend"):
             topic = f"{self.subtopic}/suspend"
             self.buttons.append(MQTTButton("suspend", topic, "mdi:power-sleep", self.suspend_callback))
         # Poweroff button
-        if self.config.get("commands", "poweroff", "false").lower() == "true":
+        if options.getbool("poweroff"):
             topic = f"{self.subtopic}/poweroff"
             self.buttons.append(MQTTButton("poweroff", topic, "mdi:power", self.poweroff_callback))
+        # Configured commands, run on their own workers
+        self.runner = None
+        commands = self._get_commands()
+        if commands:
+            workers = options.getint("workers", 2)
+            timeout = options.getfloat("timeout", 60.0, positive=True)
+            self.runner = CommandRunner(max(1, workers), timeout)
+        for name, (command, timeout) in commands.items():
+            button = MQTTButton(name, f"{self.subtopic}/{name}", "mdi:console", None, command, timeout)
+            button.callback = lambda button=button: self.command_callback(button)
+            self.buttons.append(button)
+
+    def _get_commands(self) -> Dict[str, tuple]:
+        # command_<name> = <shell command>, with an optional command_<name>_timeout in seconds
+        options = self.config.section("commands")
+        commands = {}
+        for key, value in options.options.items():
+            if not key.startswith("command_") or key.endswith("_timeout"):
+                continue
+            commands[key[len("command_") :]] = (value, options.getfloat(f"{key}_timeout", positive=True))
+        return commands
+
+    def command_callback(self, button: MQTTButton):
+        # Called within the MQTT thread, the command is run by the runner's workers
+        logger.info(f"Running command {button.name}")
+        self.runner.submit(
+            button.name, button.command, lambda result: self._publish_result(button, result), button.timeout
+        )
+
+    def _publish_result(self, button: MQTTButton, result: CommandResult):
+        self.runtime.publisher.publish(button.result_topic, json.dumps(result.to_dict()))
 
     def poweroff_callback(self):
         # This callback will be called within the MQTT thread,
-        # so we need to do the poweroff next time we are called normally
-        self.will_poweroff = True
+        # hand the poweroff over to the main loop and wake it up
+        self.runtime.call_soon(self.do_poweroff)
 
     def do_poweroff(self):
         self.runtime.on_exit()
@@ -66,22 +102,21 @@ class LinuxCommands(MQTTConsumer):
 
     def suspend_callback(self):
         # This callback will be called within the MQTT thread,
-        # so we need to do the suspend next time we are called normally
+        # hand the suspend over to the main loop and wake it up
         logger.info("Suspending requested")
-        self.will_suspend = True
+        self.runtime.call_soon(self.do_suspend)
 
     def do_suspend(self):
         self.runtime.on_suspend()
+        # This returns right away, the main loop detects when the system resumes
         subprocess.call(["systemctl", "suspend"])
-        time.sleep(10)
-        logger.info("System resumed")
-        self.runtime.on_resume()
 
-    def on_connect(self, mqtt_client):
-        # Build the homeassistant discovery message for the suspend and poweroff buttons
+    def discovery_configs(self):
+        # The homeassistant discovery messages for the suspend and poweroff buttons
+        configs = {}
         for button in self.buttons:
             homeassistant_topic = f"homeassistant/button/{self.client_name}_commands/{button.name}/config"
-            homeassistant_message = {
+            configs[homeassistant_topic] = {
                 "name": f"{button.name.title()} {self.client_name}",
                 "object_id": f"{self.client_name}_{button.name}",
                 "command_topic": f"{button.command_topic}",
@@ -91,7 +126,25 @@ class LinuxCommands(MQTTConsumer):
                 "unique_id": f"{self.client_name}_{button.name}_button",
                 "availability": {"topic": f"{self.availability_topic}"},
             }
-            mqtt_client.publish(homeassistant_topic, json.dumps(homeassistant_message), retain=True)
+            if button.command is None:
+                continue
+            # The exit code of the last run, with its output and duration as attributes
+            homeassistant_topic = f"homeassistant/sensor/{self.client_name}_commands/{button.name}_result/config"
+            configs[homeassistant_topic] = {
+                "name": f"{button.name.title()} {self.client_name} result",
+                "object_id": f"{self.client_name}_{button.name}_result",
+                "state_topic": button.result_topic,
+                "value_template": "{{ value_json.exit_code }}",
+                "json_attributes_topic": button.result_topic,
+                "icon": button.icon,
+                "device": {"identifiers": [self.client_name], "name": self.client_name, "model": "Linux2MQTT"},
+                "unique_id": f"{self.client_name}_{button.name}_result",
+                "availability": {"topic": f"{self.availability_topic}"},
+            }
+        return configs
+
+    def on_connect(self, mqtt_client):
+        for button in self.buttons:
             # Subscribe and set the callback to handle button presses
             mqtt_client.subscribe(button.command_topic)
             mqtt_client.message_callback_add(button.command_topic, self._on_button_press)
@@ -104,14 +157,16 @@ class LinuxCommands(MQTTConsumer):
             # Availability topic is set to offline globally
 
     def update_mqtt(self, mqtt_client):
-        # Nothing to publish, but:
-        # Check if we need to suspend or poweroff
-        if self.will_suspend:
-            self.do_suspend()
-            self.will_suspend = False
-        if self.will_poweroff:
-            self.do_poweroff()
-            self.will_poweroff = False
+        # Nothing to publish, button presses are handled as soon as they arrive
+        pass
+
+    def scheduled_tasks(self):
+        return []
+
+    def close(self):
+        if self.runner is not None:
+            self.runner.shutdown()
+            self.runner = None
 
     def _on_button_press(self, client, userdata, message):
         # Callback handler for button presses from MQTT
@@ -0,0 +1,224 @@
+from __future__ import annotations
+import json
+import os
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TYPE_CHECKING, List
+
+from loguru import logger
+
+from mqttconsumer import MQTTConsumer
+from host_sensors import MQTTSensor
+from discovery import sensor_config
+from scheduler import ScheduledTask
+from sysfs import SysfsFile
+
+if TYPE_CHECKING:
+    from settings import Config
+    from main import Linux2MQTT
+
+DEFAULT_PROMETHEUS_ADDRESS = "127.0.0.1"
+
+
+class DaemonMetrics(MQTTConsumer):
+    """
+    Publishes linux2mqtt's own health: how long collecting and publishing takes,
+    how late the scheduler wakes up, the MQTT outgoing queue, reconnects, CPU and memory.
+    Optionally also exported in the Prometheus text format to a file or over HTTP.
+    """
+
+    config_sections = ("metrics",)
+
+    def __init__(self, config: Config, runtime: Linux2MQTT):
+        super().__init__(config, runtime)
+        self.config = config
+        self.runtime = runtime
+        self.sensors: List[MQTTSensor] = []
+        self.availability_topic = config.availability_topic
+        self.client_name = config.client_name
+        self.publish_topic = config.topic("metrics", "metrics")
+        options = config.section("metrics")
+        self.enabled = options.getbool("enable")
+        self.textfile = options.get("prometheus_textfile")
+        self.http_server = None
+        self.prometheus = ""
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
+        self.statm = None
+        self.last_cpu = None
+        self.interval = None
+        if not self.enabled:
+            return
+        self.interval = options.getfloat("update_interval", positive=True)
+        try:
+            self.statm = SysfsFile("/proc/self/statm", 128)
+        except OSError as e:
+            logger.warning(f"Cannot read own memory usage: {e}")
+
+        metrics = [
+            ("tick_duration", "ms", "Tick Duration", "duration"),
+            ("scheduler_lag", "ms", "Scheduler Lag", "duration"),
+            ("sensor_duration", "ms", "Slowest Sensor Duration", "duration"),
+            ("queue_depth", "", "MQTT Queue Depth", None),
+            ("reconnects", "", "MQTT Reconnects", None),
+            ("first_publish", "s", "Time to First Publish", "duration"),
+            ("cpu", "%", "Daemon CPU Usage", None),
+            ("rss", "MiB", "Daemon Memory Usage", "data_size"),
+        ]
+        for name, unit, friendly_name, device_class in metrics:
+            self.sensors.append(
+                MQTTSensor(
+                    name,
+                    f"{self.publish_topic}/{name}",
+                    unit,
+                    "{{ value }}",
+                    None,
+                    f"{self.client_name.title()} Linux2MQTT {friendly_name}",
+                    device_class=device_class,
+                )
+            )
+
+        port = options.getint("prometheus_port")
+        if port:
+            # Only reachable from the host itself unless configured otherwise
+            self._start_http_server(options.get("prometheus_address", DEFAULT_PROMETHEUS_ADDRESS), port)
+
+    def _start_http_server(self, address, port):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.prometheus.encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            address_family = socket.AF_INET6 if ":" in address else socket.AF_INET
+
+        try:
+            self.http_server = Server((address, port), Handler)
+        except OSError as e:
+            logger.error(f"Cannot start metrics exporter on {address} port {port}: {e}")
+            return
+        self.http_server.daemon_threads = True
+        threading.Thread(target=self.http_server.serve_forever, name="metrics-http", daemon=True).start()
+        logger.info(f"Serving Prometheus metrics on {address} port {port}")
+
+    def _collectors(self):
+        return [c.collector for c in self.runtime.consumers if getattr(c, "collector", None) is not None]
+
+    def _sensor_durations(self):
+        durations = {}
+        for collector in self._collectors():
+            durations.update(collector.durations)
+        return durations
+
+    def _tick_duration(self):
+        # Sensor reads run on the collector's workers after run_pending returned, a tick
+        # lasts until the last read submitted in it has been published
+        cycles = [collector.cycle_duration for collector in self._collectors()]
+        return max([self.runtime.scheduler.tick_duration] + cycles)
+
+    def _cpu_percent(self):
+        times = os.times()
+        cpu = (times.user + times.system, times.elapsed)
+        last, self.last_cpu = self.last_cpu, cpu
+        if last is None or cpu[1] <= last[1]:
+            return None
+        return round((cpu[0] - last[0]) / (cpu[1] - last[1]) * 100, 1)
+
+    def _rss(self):
+        if self.statm is None:
+            return None
+        # The second field is the resident set size in pages
+        return round(int(self.statm.read().split()[1]) * self.page_size / 2**20, 1)
+
+    def collect(self):
+        scheduler = self.runtime.scheduler
+        mqtt_client = self.runtime.mqtt_client
+        durations = self._sensor_durations()
+        return {
+            "tick_duration": round(self._tick_duration() * 1000, 3),
+            "scheduler_lag": round(scheduler.lag * 1000, 3),
+            "sensor_duration": round(max(durations.values(), default=0.0) * 1000, 3),
+            # paho does not expose the queue, this is the deque of packets waiting to be written
+            "queue_depth": len(getattr(mqtt_client, "_out_packet", ())),
+            "reconnects": max(self.runtime.connect_count - 1, 0),
+            "first_publish": None if self.runtime.first_publish is None else round(self.runtime.first_publish, 3),
+            "cpu": self._cpu_percent(),
+            "rss": self._rss(),
+        }, durations
+
+    def _format_prometheus(self, values, durations):
+        labels = f'host="{self.client_name}"'
+        lines = []
+        for name, value in values.items():
+            if value is not None:
+                lines.append(f"linux2mqtt_{name}{{{labels}}} {value}")
+        for sensor, duration in durations.items():
+            lines.append(f'linux2mqtt_sensor_duration_seconds{{{labels},sensor="{sensor}"}} {duration:.6f}')
+        return "\n".join(lines) + "\n"
+
+    def _write_textfile(self):
+        # Write atomically so the node exporter never reads a partial file
+        tmp = f"{self.textfile}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                f.write(self.prometheus)
+            os.replace(tmp, self.textfile)
+        except OSError as e:
+            logger.error(f"Error writing metrics to {self.textfile}: {e}")
+
+    def scheduled_tasks(self):
+        if not self.enabled:
+            return []
+        return [ScheduledTask("metrics", self.interval, self.update_mqtt)]
+
+    def on_connect(self, mqtt_client):
+        pass
+
+    def discovery_configs(self):
+        configs = {}
+        for sensor in self.sensors:
+            topic, payload = sensor_config(
+                sensor, self.client_name, self.availability_topic, object_id=f"linux2mqtt_{sensor.name}"
+            )
+            payload["entity_category"] = "diagnostic"
+            if sensor.name == "sensor_duration":
+                # The duration of every single sensor is available as attributes
+                payload["json_attributes_topic"] = f"{self.publish_topic}/sensor_durations"
+            configs[topic] = payload
+        return configs
+
+    def on_disconnect(self, mqtt_client):
+        pass
+
+    def close(self):
+        if self.http_server is not None:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+            self.http_server = None
+        if self.statm is not None:
+            self.statm.close()
+            self.statm = None
+
+    def update_mqtt(self, mqtt_client):
+        if not self.enabled:
+            return
+        values, durations = self.collect()
+        for sensor in self.sensors:
+            value = values[sensor.name]
+            if value is not None:
+                mqtt_client.publish(sensor.state_topic, value)
+        attributes = {name: round(duration * 1000, 3) for name, duration in durations.items()}
+        mqtt_client.publish(f"{self.publish_topic}/sensor_durations", json.dumps(attributes))
+        if self.textfile or self.http_server is not None:
+            self.prometheus = self._format_prometheus(values, durations)
+        if self.textfile:
+            self._write_textfile()
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import threading
+from typing import Dict, Iterable, Tuple
+
+from loguru import logger
+
+# Discovery topics are homeassistant/<component>/<node_id>/<object_id>/config
+DISCOVERY_PREFIX = "homeassistant"
+
+
+def sensor_config(
+    sensor, client_name: str, availability_topic: str, component: str = "sensor", object_id: str = None
+) -> Tuple[str, dict]:
+    """
+    Returns the discovery topic and payload of a sensor of this client's device.
+    The object id defaults to the sensor name and makes up the unique id together with the client name.
+    """
+    object_id = object_id or sensor.name
+    payload = {
+        "name": sensor.friendly_name,
+        "state_topic": sensor.state_topic,
+        "value_template": sensor.value_template,
+        "unique_id": f"{client_name}_{object_id}",
+        "device": {"identifiers": [client_name], "name": client_name, "model": "Linux2MQTT"},
+        "availability_topic": availability_topic,
+    }
+    if sensor.unit_of_measurement:
+        payload["unit_of_measurement"] = sensor.unit_of_measurement
+    if sensor.device_class:
+        payload["device_class"] = sensor.device_class
+    return f"{DISCOVERY_PREFIX}/{component}/{client_name}/{object_id}/config", payload
+
+
+def _digest(payload: bytes) -> str:
+    return hashlib.sha1(payload).hexdigest()
+
+
+class DiscoveryPublisher:
+    """
+    Publishes the Home Assistant discovery configs of all consumers without repeating
+    identical retained messages. The payloads are serialized and hashed once. On connect,
+    the retained configs the broker already has for our node ids are collected for a short
+    settle time, and only added or changed configs are published afterwards. Configs of
+    entities that no longer exist, e.g. of sensors that were disabled, are removed by
+    publishing an empty retained message. node_ids are always checked for such configs,
+    even when none of their entities are enabled anymore.
+    """
+
+    def __init__(self, settle_time: float = 1.0, node_ids: Iterable[str] = ()):
+        self.settle_time = settle_time
+        self.node_ids = tuple(node_ids)
+        self.configs: Dict[str, Tuple[bytes, str]] = {}
+        self.retained: Dict[str, str] = {}
+        # Digests of the configs the broker has since our last publish
+        self.published: Dict[str, str] = {}
+        self.lock = threading.Lock()
+        self.timer = None
+
+    def update(self, configs: Dict[str, dict]):
+        self.configs = {}
+        for topic, payload in configs.items():
+            data = json.dumps(payload).encode()
+            self.configs[topic] = (data, _digest(data))
+
+    def _wildcards(self):
+        # One subscription per node id and not per entity
+        wildcards = {f"{DISCOVERY_PREFIX}/+/{node_id}/+/config" for node_id in self.node_ids}
+        for topic in self.configs:
+            parts = topic.split("/")
+            if len(parts) == 5 and parts[0] == DISCOVERY_PREFIX:
+                wildcards.add(f"{DISCOVERY_PREFIX}/+/{parts[2]}/+/config")
+        return sorted(wildcards)
+
+    def on_connect(self, mqtt_client):
+        if self.timer is not None:
+            self.timer.cancel()
+        with self.lock:
+            self.retained = {}
+        wildcards = self._wildcards()
+        for wildcard in wildcards:
+            mqtt_client.message_callback_add(wildcard, self._on_retained)
+            mqtt_client.subscribe(wildcard)
+        if self.settle_time > 0:
+            self.timer = threading.Timer(self.settle_time, self.sync, (mqtt_client, wildcards))
+            self.timer.daemon = True
+            self.timer.start()
+        else:
+            self.sync(mqtt_client, wildcards)
+
+    def _on_retained(self, client, userdata, message):
+        # Only the messages stored by the broker are of interest, not the ones we publish right now
+        if not message.retain or not message.payload:
+            return
+        with self.lock:
+            self.retained[message.topic] = _digest(message.payload)
+
+    def sync(self, mqtt_client, wildcards=()):
+        for wildcard in wildcards:
+            mqtt_client.unsubscribe(wildcard)
+            mqtt_client.message_callback_remove(wildcard)
+        with self.lock:
+            retained, self.retained = self.retained, {}
+        self._publish_changes(mqtt_client, retained)
+
+    def republish(self, mqtt_client):
+        """
+        Publishes the configs that changed since they were published last, e.g. after a reload.
+        """
+        self._publish_changes(mqtt_client, self.published)
+
+    def _publish_changes(self, mqtt_client, retained: Dict[str, str]):
+        published = 0
+        for topic, (data, digest) in self.configs.items():
+            if retained.get(topic) != digest:
+                mqtt_client.publish(topic, data, retain=True)
+                published += 1
+        removed = [topic for topic in retained if topic not in self.configs]
+        for topic in removed:
+            # An empty retained message deletes the entity in Home Assistant
+            mqtt_client.publish(topic, "", retain=True)
+        self.published = {topic: digest for topic, (_, digest) in self.configs.items()}
+        logger.info(
+            f"Discovery: {published} published, {len(removed)} removed, "
+            f"{len(self.configs) - published} unchanged"
+        )
@@ -1,24 +1,54 @@
 from __future__ import annotations
-import socket
+import importlib
 import json
+import math
+import re
+import shutil
 import subprocess
-import sys
+import time
 
 from dataclasses import dataclass
 from loguru import logger
-import psutil
-from typing import TYPE_CHECKING, Callable
-
-import sensors
-from Xlib import display
-from Xlib.X import AnyPropertyType
+from typing import TYPE_CHECKING, Callable, Dict
 
 from mqttconsumer import MQTTConsumer
+from scheduler import ScheduledTask
+from publish_filter import PublishFilter
+from sampling import SampleBuffer
+from collector import SensorCollector
+from discovery import sensor_config
+from procstat import ProcSnapshot
+from throughput import DeviceFilter, ThroughputSnapshot
+from proctable import ProcessTable
 
 if TYPE_CHECKING:
-    from settings import Settings
+    from settings import Config
     from main import Linux2MQTT
 
+# Default time in seconds after which an unchanged value is published again in change_only mode
+DEFAULT_MAX_AGE = 300.0
+# Default number of threads reading sensors and the time after which a read is abandoned
+DEFAULT_WORKERS = 4
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_TOP_PROCESSES = 5
+# Upper bound of samples kept between two publishes of a sampled sensor
+MAX_SAMPLES = 3600
+# Virtual devices that are not interesting for throughput sensors by default
+DEFAULT_DISK_EXCLUDE = "loop*, ram*, zram*, sr*, fd*"
+DEFAULT_NET_EXCLUDE = "lo, veth*, docker*, br-*, virbr*"
+
+
+def _import_backend(module: str, feature: str):
+    """
+    Imports the module of an optional sensor backend when the first sensor using it is enabled,
+    so headless hosts need neither Xlib nor libsensors. Returns None if it is not installed.
+    """
+    try:
+        return importlib.import_module(module)
+    except ImportError as e:
+        logger.error(f"{feature} disabled, a required module is not installed: {e}")
+        return None
+
 
 @dataclass
 class MQTTSensor:
@@ -29,28 +59,198 @@ class MQTTSensor:
     value_func: Callable
     friendly_name: str
     device_class: str = None
+    # Update interval in seconds, None for the global update interval
+    update_interval: float = None
+    # Change detection, None to publish every value
+    publish_filter: PublishFilter = None
+    # Maximum time in seconds to read the value, None for the global sensor timeout
+    timeout: float = None
+    # Returns a dict published as JSON attributes of the sensor, None for no attributes
+    attributes_func: Callable = None
+    # Sampling interval in seconds and the samples since the last publish, None if not sampled
+    sample_interval: float = None
+    samples: SampleBuffer = None
+    # Aggregates computed by the last scheduled publish, sent along again by event publishes
+    aggregates: Dict[str, float] = None
+    # Number of decimals of numeric values, None to publish them as they are read
+    precision: int = None
 
     @property
     def state_topic(self):
         return f"{self.publish_topic}"
 
+    @property
+    def attributes_topic(self):
+        return f"{self.publish_topic}/attributes"
+
+
+class SensorConsumer(MQTTConsumer):
+    """
+    Base of the consumers that publish MQTTSensors. The sensors are read on the threads of a
+    SensorCollector, and the options of the consumer's section set change detection, precision
+    and read timeouts for all of its sensors, or prefixed with the sensor name for a single one.
+    """
+
+    # Number of threads reading the sensors unless the section sets workers
+    default_workers = DEFAULT_WORKERS
 
-class HostSensors(MQTTConsumer):
-    def __init__(self, config: Settings, runtime: Linux2MQTT):
+    def __init__(self, config: Config, runtime: Linux2MQTT, section: str):
         super().__init__(config, runtime)
         self.config = config
+        self.runtime = runtime
+        self.options = config.section(section)
         self.sensors = []
-        self.availability_topic = runtime.availability_topic
-        head_topic = self.config.get("mqtt", "topic", "linux2mqtt")
-        client = self.config.get("client", "name", socket.gethostname())
-        subtopic = self.config.get("sensors", "sub_topic", "sensors")
-        self.publish_topic = f"{head_topic}/{client}/{subtopic}"
-        if self.config.get("sensors", "enable", "false").lower() != "true":
+        self.collector = None
+        self.availability_topic = config.availability_topic
+
+    def _setup_sensor(self, sensor: MQTTSensor):
+        sensor.publish_filter = self._parse_publish_filter(sensor.name)
+        sensor.timeout = self._parse_seconds(f"{sensor.name}_timeout", None)
+        sensor.precision = self.options.getint(f"{sensor.name}_precision", self.options.getint("precision"))
+
+    def _start_collector(self):
+        # Sensors are read concurrently, so a single slow sensor does not delay the others
+        workers = self.options.getint("workers", self.default_workers)
+        timeout = self._parse_seconds("timeout", DEFAULT_TIMEOUT)
+        self.collector = SensorCollector(max(1, workers), timeout)
+
+    def _parse_seconds(self, key, default):
+        return self.options.getfloat(key, default, positive=True)
+
+    def _parse_publish_filter(self, name):
+        change_only = self.options.getbool("change_only")
+        change_only = self.options.getbool(f"{name}_change_only", change_only)
+        if not change_only:
+            return None
+        deadband = self.options.getfloat(f"{name}_deadband", 0.0)
+        deadband_percent = self.options.getfloat(f"{name}_deadband_percent", 0.0)
+        max_age = self._parse_seconds("max_age", DEFAULT_MAX_AGE)
+        max_age = self._parse_seconds(f"{name}_max_age", max_age)
+        return PublishFilter(deadband, deadband_percent, max_age)
+
+    def on_connect(self, mqtt_client):
+        # Values published before the connection was lost may be gone, publish everything again
+        for sensor in self.sensors:
+            if sensor.publish_filter is not None:
+                sensor.publish_filter.reset()
+
+    def discovery_configs(self):
+        configs = {}
+        for sensor in self.sensors:
+            topic, payload = sensor_config(sensor, self.config.client_name, self.availability_topic)
+            configs[topic] = payload
+        return configs
+
+    def on_disconnect(self, mqtt_client):
+        for sensor in self.sensors:
+            mqtt_client.publish(sensor.state_topic, "")
+
+    def update_mqtt(self, mqtt_client):
+        if not self.enabled:
+            return
+        for sensor in self.sensors:
+            self._publish_sensor(mqtt_client, sensor)
+
+    def _read_sensor(self, sensor: MQTTSensor):
+        try:
+            return sensor.value_func()
+        except Exception as e:
+            logger.error(f"Error reading sensor {sensor.name}: {e}")
+        return None
+
+    def _publish_sensor(self, mqtt_client, sensor: MQTTSensor):
+        # The value is read on a worker thread and published from there once available
+        self.collector.submit(
+            sensor.name,
+            sensor.value_func,
+            lambda value: self._on_sensor_value(mqtt_client, sensor, value),
+            sensor.timeout,
+        )
+
+    @staticmethod
+    def _round(sensor: MQTTSensor, value):
+        if sensor.precision is None or not isinstance(value, float):
+            return value
+        # Rounded floats are published with their shortest representation
+        return round(value, sensor.precision) if sensor.precision > 0 else round(value)
+
+    def _payload(self, sensor: MQTTSensor, value, aggregate=True):
+        # A sampled sensor publishes its value together with the aggregates since the last publish.
+        # Only scheduled publishes aggregate, event publishes repeat the last aggregates and leave the samples alone
+        if sensor.samples is None:
+            return self._round(sensor, value)
+        if aggregate:
+            sensor.samples.add(value)
+            sensor.aggregates = sensor.samples.aggregate() or {}
+        aggregates = sensor.aggregates or {}
+        return {"value": self._round(sensor, value), **{k: self._round(sensor, v) for k, v in aggregates.items()}}
+
+    def _on_sensor_value(self, mqtt_client, sensor: MQTTSensor, value):
+        if value is None:
+            return
+        if sensor.attributes_func is not None:
+            self._publish_attributes(mqtt_client, sensor)
+        self._publish_value(mqtt_client, sensor, value)
+
+    def _publish_attributes(self, mqtt_client, sensor: MQTTSensor):
+        try:
+            mqtt_client.publish(sensor.attributes_topic, json.dumps(sensor.attributes_func()))
+        except Exception as e:
+            logger.error(f"Error publishing attributes of sensor {sensor.name}: {e}")
+
+    @staticmethod
+    def _should_publish(sensor: MQTTSensor, value, now: float, aggregate=True) -> bool:
+        if sensor.publish_filter is None or sensor.publish_filter.should_publish(value, now):
+            return True
+        if not aggregate or sensor.samples is None:
+            return False
+        # A spike between two updates is published even if the value itself is back within the deadband
+        aggregates = sensor.samples.aggregate(clear=False) or {}
+        return any(sensor.publish_filter.changed(aggregates[key]) for key in ("max", "p95") if key in aggregates)
+
+    def _publish_value(self, mqtt_client, sensor: MQTTSensor, value, force=False, aggregate=True):
+        now = time.monotonic()
+        if not force and not self._should_publish(sensor, value, now, aggregate):
+            return
+        payload = self._payload(sensor, value, aggregate)
+        try:
+            mqtt_client.publish(sensor.state_topic, payload if sensor.samples is None else json.dumps(payload))
+        except Exception as e:
+            logger.error(f"Error publishing sensor {sensor.name}: {e}")
+            return
+        if sensor.publish_filter is not None:
+            sensor.publish_filter.published(value, now)
+
+    def close(self):
+        if self.collector is not None:
+            self.collector.shutdown()
+            self.collector = None
+
+
+class HostSensors(SensorConsumer):
+    # The sample buffers and which sensors are sampled depend on [client] update_interval
+    config_sections = ("sensors", "client")
+
+    def __init__(self, config: Config, runtime: Linux2MQTT):
+        super().__init__(config, runtime, "sensors")
+        self.cpu_temp_reader = None
+        self.x_session = None
+        self.proc = None
+        self.throughput = None
+        self.process_table = None
+        client = config.client_name
+        self.publish_topic = config.topic("sensors", "sensors")
+        # In batch mode all sensors are published as a single JSON document
+        self.batch = self.options.getbool("batch")
+        self.batch_topic = f"{self.publish_topic}/state"
+        self.snapshot = {}
+        self.enabled = self.options.getbool("enable")
+        if not self.enabled:
             logger.info("Sensors disabled")
             return
         logger.info(f"Publishing sensor data to {self.publish_topic}")
 
-        if self.config.get("sensors", "cpu_temp", "false").lower() == "true":
+        if self.options.getbool("cpu_temp") and self._setup_cpu_temp():
             self.sensors.append(
                 MQTTSensor(
                     "cpu_temp",
@@ -61,7 +261,9 @@ class HostSensors(MQTTConsumer):
                     f"{client.title()} CPU Temperature",
                 )
             )
-        if self.config.get("sensors", "cpu_usage", "false").lower() == "true":
+        if self.options.getbool("cpu_usage"):
+            # Create the snapshot now, its first sample is the baseline for the first usage value
+            self._get_proc_snapshot()
             self.sensors.append(
                 MQTTSensor(
                     "cpu_usage",
@@ -72,168 +274,411 @@ class HostSensors(MQTTConsumer):
                     f"{client.title()} CPU Usage",
                 )
             )
-        if self.config.get("sensors", "x_idle", "false").lower() == "true" and self._xprintidle_exists():
+        self._add_proc_sensors(client)
+        self._add_throughput_sensors(client)
+        if self.options.getbool("top_processes"):
+            self._add_top_process_sensors(client)
+        if self.options.getbool("x_idle") and self._get_x_session() is not None:
+            self.xprintidle = self._xprintidle_exists()
+            self.x_idle_sensor = MQTTSensor(
+                "x_idle",
+                f"{self.publish_topic}/x_idle",
+                "s",
+                "{{ value | int }}",
+                self._get_x_idle,
+                f"{client.title()} X Server Idle Time",
+                device_class="duration",
+            )
+            self.sensors.append(self.x_idle_sensor)
+            thresholds = self._parse_idle_thresholds()
+            if thresholds:
+                # Publish as soon as a threshold is crossed so automations do not depend on the update interval
+                self._get_x_session(thresholds).add_idle_listener(self._on_idle_threshold)
+        if self.options.getbool("x_active_window") and self._get_x_session() is not None:
+            self.active_window_sensor = MQTTSensor(
+                "active_window",
+                f"{self.publish_topic}/active_window",
+                "",
+                "{{ value }}",
+                self._get_active_window_process_x,
+                f"{client.title()} Active Window",
+                device_class="enum",
+            )
+            self.sensors.append(self.active_window_sensor)
+            # Publish focus changes right away instead of waiting for the next update
+            self._get_x_session().add_active_window_listener(self._on_active_window_change)
+        if self.x_session is not None:
+            self.x_session.start()
+
+        for sensor in self.sensors:
+            sensor.update_interval = self._parse_interval(sensor.name)
+            self._setup_sensor(sensor)
+            self._setup_sampling(sensor)
+        self._start_collector()
+
+    def _add_proc_sensors(self, client):
+        # All of these are derived from a single read of /proc/stat, /proc/meminfo and /proc/loadavg per tick
+        def add(name, unit, func, friendly_name, device_class=None):
+            self._get_proc_snapshot()
             self.sensors.append(
                 MQTTSensor(
-                    "x_idle",
-                    f"{self.publish_topic}/x_idle",
-                    "s",
-                    "{{ value | int }}",
-                    self._get_x_idle,
-                    f"{client.title()} X Server Idle Time",
-                    device_class="duration",
+                    name,
+                    f"{self.publish_topic}/{name}",
+                    unit,
+                    "{{ value }}",
+                    lambda: self._get_proc_snapshot().get(func),
+                    f"{client.title()} {friendly_name}",
+                    device_class=device_class,
+                )
+            )
+
+        if self.options.getbool("cpu_cores"):
+            for core in self._get_proc_snapshot().cores:
+                add(f"cpu{core}_usage", "%", lambda s, core=core: s.cpu_usage(core), f"CPU {core} Usage")
+        if self.options.getbool("cpu_iowait"):
+            add("cpu_iowait", "%", ProcSnapshot.cpu_iowait, "CPU IO Wait")
+        if self.options.getbool("cpu_steal"):
+            add("cpu_steal", "%", ProcSnapshot.cpu_steal, "CPU Steal")
+        if self.options.getbool("memory"):
+            add("memory_used", "%", ProcSnapshot.memory_used_percent, "Memory Usage")
+            add("memory_available", "MiB", ProcSnapshot.memory_available, "Memory Available", "data_size")
+        if self.options.getbool("swap"):
+            add("swap_used", "%", ProcSnapshot.swap_used_percent, "Swap Usage")
+        if self.options.getbool("load"):
+            for i, minutes in enumerate((1, 5, 15)):
+                add(f"load_{minutes}", "", lambda s, i=i: s.load[i], f"Load Average {minutes} min")
+
+    def _add_throughput_sensors(self, client):
+        # All disks and interfaces are read from a single read of /proc/diskstats and /proc/net/dev per tick
+        disk_filter = net_filter = None
+        if self.options.getbool("disks"):
+            disk_filter = DeviceFilter(
+                self.options.get("disk_include", "*"), self.options.get("disk_exclude", DEFAULT_DISK_EXCLUDE)
+            )
+        if self.options.getbool("network"):
+            net_filter = DeviceFilter(
+                self.options.get("net_include", "*"), self.options.get("net_exclude", DEFAULT_NET_EXCLUDE)
+            )
+        if disk_filter is None and net_filter is None:
+            return
+        try:
+            self.throughput = ThroughputSnapshot(disk_filter, net_filter)
+        except OSError as e:
+            logger.error(f"Cannot read disk and network statistics: {e}")
+            return
+
+        def add(name, unit, func, friendly_name, device_class=None):
+            self.sensors.append(
+                MQTTSensor(
+                    name,
+                    f"{self.publish_topic}/{name}",
+                    unit,
+                    "{{ value }}",
+                    lambda: self.throughput.get(func),
+                    f"{client.title()} {friendly_name}",
+                    device_class=device_class,
                 )
             )
-        if self.config.get("sensors", "x_active_window", "false").lower() == "true":
+
+        def kilobytes(rate):
+            return None if rate is None else round(rate / 1000, 1)
+
+        def per_second(rate):
+            return None if rate is None else round(rate, 1)
+
+        for disk in self.throughput.disk_names():
+            key = re.sub(r"\W", "_", disk)
+            for index, suffix, unit, convert, label, device_class in (
+                (0, "read", "kB/s", kilobytes, "Read", "data_rate"),
+                (1, "write", "kB/s", kilobytes, "Write", "data_rate"),
+                (2, "read_iops", "IOPS", per_second, "Read IOPS", None),
+                (3, "write_iops", "IOPS", per_second, "Write IOPS", None),
+            ):
+                func = lambda s, disk=disk, index=index, convert=convert: convert(s.disk_rate(disk, index))
+                add(f"disk_{key}_{suffix}", unit, func, f"Disk {disk} {label}", device_class)
+        for interface in self.throughput.net_names():
+            key = re.sub(r"\W", "_", interface)
+            for index, suffix, unit, convert, label, device_class in (
+                (0, "rx", "kB/s", kilobytes, "Received", "data_rate"),
+                (1, "tx", "kB/s", kilobytes, "Sent", "data_rate"),
+                (2, "rx_packets", "packets/s", per_second, "Received Packets", None),
+                (3, "tx_packets", "packets/s", per_second, "Sent Packets", None),
+            ):
+                func = lambda s, name=interface, index=index, convert=convert: convert(s.net_rate(name, index))
+                add(f"net_{key}_{suffix}", unit, func, f"Network {interface} {label}", device_class)
+
+    def _add_top_process_sensors(self, client):
+        count = self.options.getint("top_processes_count", DEFAULT_TOP_PROCESSES)
+        table = self._get_process_table()
+        # Take the first sample now, so the first update already has CPU usage values
+        table.get(lambda t: None)
+
+        def state(top, format_value, unit):
+            # The state is the top process, the full list is published as attributes
+            return None if not top else f"{table.full_name(top[0])} ({format_value(top[0])} {unit})"
+
+        def attributes(top, key, format_value):
+            processes = [{"pid": e.pid, "name": table.full_name(e), key: format_value(e)} for e in top]
+            return {"processes": processes}
+
+        def cpu(entry):
+            return round(entry.cpu_percent, 1)
+
+        def rss(entry):
+            # In MiB
+            return round(entry.rss / 2**20, 1)
+
+        for name, select, key, format_value, unit, friendly_name in (
+            ("top_cpu", ProcessTable.top_cpu, "cpu_percent", cpu, "%", "Top Process by CPU"),
+            ("top_memory", ProcessTable.top_rss, "rss_mib", rss, "MiB", "Top Process by Memory"),
+        ):
             self.sensors.append(
                 MQTTSensor(
-                    "active_window",
-                    f"{self.publish_topic}/active_window",
+                    name,
+                    f"{self.publish_topic}/{name}",
                     "",
                     "{{ value }}",
-                    self._get_active_window_process_x,
-                    f"{client.title()} Active Window",
-                    device_class="enum",
+                    lambda select=select, f=format_value, u=unit: table.get(lambda t: state(select(t, count), f, u)),
+                    f"{client.title()} {friendly_name}",
+                    attributes_func=lambda select=select, key=key, f=format_value: table.get(
+                        lambda t: attributes(select(t, count), key, f)
+                    ),
                 )
             )
 
-        self.first_cpu_percent = True
+    def _get_process_table(self):
+        # Shared between the top processes sensors and the active window sensor
+        if self.process_table is None:
+            self.process_table = ProcessTable()
+        return self.process_table
 
-    def _xprintidle_exists(self):
+    def _get_proc_snapshot(self):
+        if self.proc is None:
+            self.proc = ProcSnapshot()
+        return self.proc
+
+    def _setup_cpu_temp(self):
+        sensor = self.options.get("cpu_temp_sensor")
+        use_sysfs = self.options.getbool("cpu_temp_sysfs", True)
+        hwmon = _import_backend("hwmon", "CPU temperature")
+        if hwmon is None:
+            return False
         try:
-            subprocess.check_output(["which", "xprintidle"])
-            return True
-        except:
-            logger.warning("xprintidle not found. Install xprintidle to get X server idle time.")
+            self.cpu_temp_reader = hwmon.TemperatureReader(sensor, use_sysfs)
+        except ValueError as e:
+            logger.error(f"Invalid CPU temperature sensor: {e}")
             return False
+        # Validate at startup, reading will retry resolving if the chip appears later
+        self.cpu_temp_reader.resolve()
+        return True
+
+    def _setup_sampling(self, sensor: MQTTSensor):
+        # Only numeric sensors without attributes of their own can be sampled
+        if sensor.attributes_func is not None or sensor.device_class == "enum":
+            return
+        interval = self._parse_seconds("sample_interval", None)
+        interval = self._parse_seconds(f"{sensor.name}_sample_interval", interval)
+        update_interval = sensor.update_interval or self.config.update_interval
+        if interval is None or interval >= update_interval:
+            return
+        sensor.sample_interval = interval
+        sensor.samples = SampleBuffer(min(math.ceil(update_interval / interval) + 1, MAX_SAMPLES))
+
+    def _parse_interval(self, name):
+        return self._parse_seconds(f"{name}_interval", None)
+
+    def _get_x_session(self, idle_thresholds=None):
+        # A single X connection is shared between all X sensors
+        if self.x_session is None:
+            xsession = _import_backend("xsession", "X server sensors")
+            if xsession is None:
+                return None
+            self.x_session = xsession.XSession(process_table=self._get_process_table())
+        if idle_thresholds:
+            self.x_session.idle_thresholds = sorted(idle_thresholds)
+        return self.x_session
+
+    def _parse_idle_thresholds(self):
+        thresholds = self.options.get("x_idle_thresholds", "")
+        try:
+            return [float(t) for t in thresholds.split(",") if t.strip()]
+        except ValueError:
+            logger.error(f"Invalid X idle thresholds: {thresholds}")
+            return []
+
+    def _xprintidle_exists(self):
+        # Only used as a fallback if the X server does not support the MIT-SCREEN-SAVER extension
+        if shutil.which("xprintidle") is None:
+            logger.debug("xprintidle not found, X server idle time requires the MIT-SCREEN-SAVER extension")
+            return False
+        return True
+
+    def close(self):
+        super().close()
+        if self.x_session is not None:
+            self.x_session.stop()
+            self.x_session = None
+        for resource in (self.cpu_temp_reader, self.proc, self.throughput):
+            if resource is not None:
+                resource.close()
+        self.cpu_temp_reader = self.proc = self.throughput = None
 
     def __del__(self):
-        sensors.cleanup()
+        self.close()
 
     def _get_active_window_process_x(self):
-        try:
-            disp = display.Display()
-            root = disp.screen().root
-            window_id = root.get_full_property(disp.intern_atom('_NET_ACTIVE_WINDOW'), AnyPropertyType).value[0]
-            window = disp.create_resource_object('window', window_id)
-            pid = window.get_full_property(disp.intern_atom('_NET_WM_PID'), 0)
-            if pid:
-                pid = pid.value[0]
-                process = psutil.Process(pid)
-                process = f"{process.name()} ({process.status()})"
-            else:
-                process = None
-            wm_class = window.get_wm_class()[0]
-            if wm_class:
-                process = f"{wm_class} - {process}" if process else wm_class
-            return process
-        except Exception as e:
-            logger.warning(f"Error getting active window process: {e}")
-        return None
+        return self.x_session.get_active_window_process()
 
-    def _get_cpu_temp(self):
-        sensor = self.config.get("sensors", "cpu_temp_sensor", None)
-        if not sensor or sensor.count(":") != 2:
-            logger.error("Invalid CPU temperature sensor name")
-            return
-        chip, feature, subfeature = sensor.split(":")
-        chip_cls = None
-        chips = sensors.get_detected_chips()
-        for c in chips:
-            if str(c) == chip:
-                chip_cls = c
-                break
-        if chip_cls is None:
-            logger.error(f"Chip {chip} not found. Available: {[str(c) for c in chips]}")
-            return
-        feature_cls = None
-        features = chip_cls.get_features()
-        for f in features:
-            if chip_cls.get_label(f) == feature:
-                feature_cls = f
-                break
-        if feature_cls is None:
-            logger.error(
-                f"Feature {feature} on chip {chip} not found. Available: {[chip_cls.get_label(f) for f in features]}"
-            )
-            return
-        subfeature_cls = None
-        subfeatures = chip_cls.get_all_subfeatures(feature_cls)
-        for s in subfeatures:
-            if s.name == subfeature:
-                subfeature_cls = s
-                break
-        if subfeature_cls is None:
-            logger.error(
-                f"Subfeature {subfeature} on feature {feature} on chip {chip} not found. Available: {subfeatures}"
-            )
-            return
-        try:
-            value = chip_cls.get_value_or_none(subfeature_cls.number)
-        except Exception as e:
-            logger.error(f"Error reading value for {feature}: {e}")
-            return
+    def _on_active_window_change(self):
+        value = self._read_sensor(self.active_window_sensor)
+        if value is not None:
+            self._publish_event(self.active_window_sensor, value)
 
-        logger.debug(f"CPU temperature of {sensor}: {value} °C")
+    def _get_cpu_temp(self):
+        value = self.cpu_temp_reader.read()
+        logger.debug(f"CPU temperature of {self.cpu_temp_reader.spec}: {value} °C")
         return value
 
     def _get_cpu_usage(self):
-        cpu_usage = psutil.cpu_percent(interval=None)
+        cpu_usage = self._get_proc_snapshot().get(ProcSnapshot.cpu_usage)
         logger.debug(f"CPU usage: {cpu_usage} %")
-        if self.first_cpu_percent:
-            self.first_cpu_percent = False
-            return None
         return cpu_usage
 
     def _get_x_idle(self):
-        try:
-            output = subprocess.check_output(["xprintidle"]).strip()
-        except Exception as e:
-            logger.error(f"Error reading xprintidle: {e}")
-            sys.exit(1)
-            return
-        idle = int(output) / 1000
+        idle = self._get_x_session().get_idle()
+        if idle is None and self.xprintidle:
+            try:
+                idle = int(subprocess.check_output(["xprintidle"]).strip()) / 1000
+            except Exception as e:
+                logger.error(f"Error reading xprintidle: {e}")
+                return None
         logger.debug(f"X server idle: {idle} s")
         return idle
 
-    def on_connect(self, mqtt_client):
-        # We do not need to subscribe to any topics, but we need to publish the homeassistant metadata if enabled
-        if self.config.get("mqtt", "homeassistant", "false").lower() != "true":
-            logger.info("Homeassistant integration disabled")
-            return
-        if self.config.get("sensors", "enable", "false").lower() != "true":
-            return
-        client_name = self.config.get("client", "name", socket.gethostname())
+    def _on_idle_threshold(self, idle):
+        logger.debug(f"X server idle threshold crossed: {idle} s")
+        self._publish_event(self.x_idle_sensor, idle, force=True)
 
+    def discovery_configs(self):
+        if not self.enabled:
+            return {}
+        configs = {}
         for sensor in self.sensors:
-            topic = f"homeassistant/sensor/{client_name}/{sensor.name}/config"
-            payload = {
-                "name": sensor.friendly_name,
-                "state_topic": sensor.state_topic,
-                "unit_of_measurement": sensor.unit_of_measurement,
-                "value_template": sensor.value_template,
-                "unique_id": f"{client_name}_{sensor.name}",
-                "device": {"identifiers": [client_name], "name": client_name, "model": "Linux2MQTT"},
-                "availability_topic": self.availability_topic,
-            }
-            if sensor.device_class:
-                payload["device_class"] = sensor.device_class
-            mqtt_client.publish(topic, json.dumps(payload), retain=True)
+            topic, payload = sensor_config(sensor, self.config.client_name, self.availability_topic)
+            # In batch mode all values are published in one JSON document, pick ours from it
+            state_topic = self.batch_topic if self.batch else sensor.state_topic
+            value = f"value_json.{sensor.name}" if self.batch else "value"
+            if sensor.samples is not None:
+                # The value comes with the aggregates of the samples, which become the attributes
+                value = f"value_json.{sensor.name}" if self.batch else "value_json"
+                attributes_template = f"{{{{ {value} | tojson }}}}"
+                value = f"{value}.value"
+            payload["state_topic"] = state_topic
+            payload["value_template"] = re.sub(r"\bvalue\b", value, sensor.value_template)
+            if sensor.attributes_func is not None:
+                payload["json_attributes_topic"] = sensor.attributes_topic
+            elif sensor.samples is not None:
+                payload["json_attributes_topic"] = state_topic
+                payload["json_attributes_template"] = attributes_template
+            configs[topic] = payload
+        return configs
 
     def on_disconnect(self, mqtt_client):
         # Delete the data we have written as it will become stale very quickly
         # Availability will be set to offline globally
-        for sensor in self.sensors:
-            mqtt_client.publish(sensor.state_topic, "")
+        if self.batch:
+            mqtt_client.publish(self.batch_topic, "")
+            return
+        super().on_disconnect(mqtt_client)
+
+    def scheduled_tasks(self):
+        if not self.enabled:
+            return []
+        if self.batch:
+            # Sensors on the global interval are read right before the snapshot is published,
+            # sensors with their own interval only update their entry in the snapshot
+            tasks = [ScheduledTask("sensors:batch", None, self._update_batch)]
+            sensors = [sensor for sensor in self.sensors if sensor.update_interval is not None]
+        else:
+            tasks = []
+            sensors = self.sensors
+        # Every sensor is updated at its own interval
+        tasks += [
+            ScheduledTask(
+                f"sensor:{sensor.name}",
+                sensor.update_interval,
+                lambda mqtt_client, sensor=sensor: self._publish_sensor(mqtt_client, sensor),
+            )
+            for sensor in sensors
+        ]
+        # Sampled sensors are also read in between, into their sample buffers
+        tasks += [
+            ScheduledTask(
+                f"sample:{sensor.name}", sensor.sample_interval, lambda mqtt_client, sensor=sensor: self._sample(sensor)
+            )
+            for sensor in self.sensors
+            if sensor.samples is not None
+        ]
+        return tasks
 
     def update_mqtt(self, mqtt_client):
-        if self.config.get("sensors", "enable", "false").lower() != "true":
+        if self.enabled and self.batch:
+            self._update_batch(mqtt_client)
             return
+        super().update_mqtt(mqtt_client)
 
-        for sensor in self.sensors:
-            try:
-                value = sensor.value_func()
-                if value is not None:
-                    mqtt_client.publish(sensor.state_topic, value)
-            except Exception as e:
-                logger.error(f"Error publishing sensor {sensor.name}: {e}")
+    def _sample(self, sensor: MQTTSensor):
+        self.collector.submit(f"{sensor.name}:sample", sensor.value_func, sensor.samples.add, sensor.timeout)
+
+    def _on_sensor_value(self, mqtt_client, sensor: MQTTSensor, value):
+        if not self.batch:
+            super()._on_sensor_value(mqtt_client, sensor, value)
+            return
+        if value is None:
+            return
+        if sensor.attributes_func is not None:
+            self._publish_attributes(mqtt_client, sensor)
+        self.snapshot[sensor.name] = value
+
+    def _publish_event(self, sensor: MQTTSensor, value, force=False):
+        # Called from the X session thread, paho's publish is thread safe
+        if self.runtime.mqtt_client is None or not self.runtime.mqtt_client.is_connected():
+            return
+        mqtt_client = self.runtime.publisher
+        if self.batch:
+            self.snapshot[sensor.name] = value
+            self._publish_snapshot(mqtt_client, force, aggregate=False)
+        else:
+            self._publish_value(mqtt_client, sensor, value, force, aggregate=False)
+
+    def _update_batch(self, mqtt_client):
+        sensors = [sensor for sensor in self.sensors if sensor.update_interval is None]
+        reads = [(sensor.name, sensor.value_func, sensor.timeout) for sensor in sensors]
+        # The snapshot is published once the reads finished or timed out, the scheduler does not wait for them
+        self.collector.collect(reads, lambda values: self._on_batch_values(mqtt_client, sensors, values))
+
+    def _on_batch_values(self, mqtt_client, sensors, values):
+        self.snapshot.update(values)
+        self._publish_snapshot(mqtt_client)
+        for sensor in sensors:
+            if sensor.attributes_func is not None and sensor.name in values:
+                self._publish_attributes(mqtt_client, sensor)
+
+    def _publish_snapshot(self, mqtt_client, force=False, aggregate=True):
+        snapshot = dict(self.snapshot)
+        if not snapshot:
+            return
+        now = time.monotonic()
+        sensors = [sensor for sensor in self.sensors if sensor.name in snapshot]
+        # The snapshot is published if any of the values needs to be published on its own
+        if not force and not any(self._should_publish(s, snapshot[s.name], now, aggregate) for s in sensors):
+            return
+        document = {sensor.name: self._payload(sensor, snapshot[sensor.name], aggregate) for sensor in sensors}
+        try:
+            mqtt_client.publish(self.batch_topic, json.dumps(document))
+        except Exception as e:
+            logger.error(f"Error publishing sensor snapshot: {e}")
+            return
+        for sensor in sensors:
+            if sensor.publish_filter is not None:
+                sensor.publish_filter.published(snapshot[sensor.name], now)
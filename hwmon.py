@@ -0,0 +1,103 @@
+import atexit
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from loguru import logger
+
+import sensors
+
+from sysfs import SysfsFile
+
+# libsensors is shared by all readers, a reload replaces them but keeps using it
+atexit.register(sensors.cleanup)
+
+
+def _to_str(value) -> str:
+    if isinstance(value, bytes):
+        return value.decode(errors="replace")
+    return str(value)
+
+
+@dataclass
+class SubfeatureHandle:
+    chip: Any
+    number: int
+    # Path of the hwmon attribute file (e.g. /sys/class/hwmon/hwmon2/temp1_input), if known
+    sysfs_path: Optional[str] = None
+
+
+class TemperatureReader:
+    """
+    Reads a single libsensors subfeature given as `chip:feature:subfeature`.
+    The handle is resolved once and then read directly, preferably through
+    a kept-open hwmon sysfs file. It is only resolved again if a read fails,
+    e.g. after a hotplug or a driver reload.
+    """
+
+    def __init__(self, spec: str, use_sysfs: bool = True):
+        if not spec or spec.count(":") != 2:
+            raise ValueError(f"Invalid sensor name '{spec}', expected chip:feature:subfeature")
+        self.spec = spec
+        self.key: Tuple[str, str, str] = tuple(spec.split(":"))
+        self.use_sysfs = use_sysfs
+        self.index: Dict[Tuple[str, str, str], SubfeatureHandle] = {}
+        self.handle: Optional[SubfeatureHandle] = None
+        self.file: Optional[SysfsFile] = None
+
+    def build_index(self):
+        # Index every available reading once, this is the only place walking the chip list
+        self.index = {}
+        for chip in sensors.get_detected_chips():
+            chip_name = str(chip)
+            chip_path = getattr(chip, "path", None)
+            chip_path = _to_str(chip_path) if chip_path else None
+            for feature in chip.get_features():
+                label = chip.get_label(feature)
+                for subfeature in chip.get_all_subfeatures(feature):
+                    name = _to_str(subfeature.name)
+                    sysfs_path = os.path.join(chip_path, name) if chip_path else None
+                    self.index[(chip_name, label, name)] = SubfeatureHandle(chip, subfeature.number, sysfs_path)
+
+    def resolve(self) -> bool:
+        self.close()
+        self.build_index()
+        self.handle = self.index.get(self.key)
+        if self.handle is None:
+            available = [":".join(k) for k in self.index]
+            logger.error(f"Sensor {self.spec} not found. Available: {available}")
+            return False
+        if self.use_sysfs and self.handle.sysfs_path:
+            try:
+                self.file = SysfsFile(self.handle.sysfs_path, 32)
+                logger.debug(f"Reading {self.spec} from {self.handle.sysfs_path}")
+            except OSError as e:
+                logger.debug(f"Cannot open {self.handle.sysfs_path}, using libsensors: {e}")
+        return True
+
+    def _read_once(self) -> Optional[float]:
+        if self.file is not None:
+            # hwmon temperatures are reported in millidegrees Celsius
+            return self.file.read_int() / 1000
+        return self.handle.chip.get_value_or_none(self.handle.number)
+
+    def read(self) -> Optional[float]:
+        if self.handle is None and not self.resolve():
+            return None
+        try:
+            return self._read_once()
+        except Exception as e:
+            logger.warning(f"Error reading {self.spec}, resolving again: {e}")
+        if not self.resolve():
+            return None
+        try:
+            return self._read_once()
+        except Exception as e:
+            logger.error(f"Error reading {self.spec}: {e}")
+            self.handle = None
+        return None
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
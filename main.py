@@ -1,112 +1,369 @@
+import queue
 import socket
-import time
 import uuid
 import sys
 import signal
+import time
 
 from paho.mqtt import client as mqtt
 from loguru import logger
 from typing import List
 
 from mqttconsumer import MQTTConsumer
-from settings import Settings
+from scheduler import ScheduledTask, Scheduler
+from suspend import LogindSleepMonitor, SuspendDetector
+from discovery import DiscoveryPublisher
+from spool import BufferedClient, OfflineSpool
+from mqtt5 import TopicAliases
+from systemd_notify import SystemdNotifier
+from settings import Config, Settings
 from host_sensors import HostSensors
 from commands import LinuxCommands
+from daemon_metrics import DaemonMetrics
+from cgroup_sensors import CgroupSensors
+from power_sensors import PowerSensors
 
-# The amount of time to sleep between checks if the main loop should exit
-# MQTT update time is configured by the user and can be larger
-MAIN_LOOP_SLEEP_TIME = 0.5
+# Default bounds in seconds of the exponential backoff between connection attempts
+DEFAULT_RECONNECT_MIN_DELAY = 1
+DEFAULT_RECONNECT_MAX_DELAY = 120
+# Longest time in seconds to hold back a suspend until the offline availability was sent
+SUSPEND_PUBLISH_TIMEOUT = 2.0
 
 
 class Linux2MQTT:
-    def __init__(self):
+    def __init__(self, settings: Settings = None):
         self.running = False
-        self.config = Settings()
+        # Time to first publish is measured from here
+        self.started = time.monotonic()
+        self.first_publish = None
+        self.settings = settings or Settings()
+        # Everything reads this immutable snapshot, a reload replaces it as a whole
+        self.config: Config = self.settings.snapshot()
         self.mqtt_client: mqtt = None
-        head_topic = self.config.get("mqtt", "topic", "linux2mqtt")
-        host = self.config.get("client", "name", socket.gethostname())
-        self.publish_topic = f"{head_topic}/{host}"
-        self.availability_topic = f"{self.publish_topic}/availability"
-        signal.signal(signal.SIGHUP, self.on_exit)
+        self.scheduler = Scheduler()
+        # Calls handed over from other threads, run by the main loop as soon as it wakes up
+        self.calls = queue.SimpleQueue()
+        self.connect_count = 0
+        self.publish_topic = self.config.base_topic
+        self.availability_topic = self.config.availability_topic
+        signal.signal(signal.SIGHUP, self.on_reload)
         signal.signal(signal.SIGINT, self.on_exit)
         signal.signal(signal.SIGTERM, self.on_exit)
 
-        sleep_time = self.config.get("client", "update_interval", "60")
-        try:
-            self.sleep_time = int(sleep_time)
-        except ValueError:
-            logger.error(f"Invalid update interval: {sleep_time}")
-            self.sleep_time = 60
+        self.suspend_detector = SuspendDetector()
+        self.sleep_monitor = None
+        self.notifier = SystemdNotifier()
+
+        self.spool = self._create_spool()
+        options = self.config.section("mqtt")
+        self.mqtt_v5 = options.get("protocol", "3.1.1").strip().lower() in ("5", "5.0", "v5")
+        self.aliases = None
+        if self.mqtt_v5:
+            self.aliases = TopicAliases(options.getbool("topic_aliases", True), options.getint("message_expiry"))
+        # Consumers publish through this, so messages are buffered while we are offline
+        self.publisher = BufferedClient(self, self.spool, self.aliases)
+
+        self.consumers: List[MQTTConsumer] = [
+            HostSensors(self.config, self),
+            LinuxCommands(self.config, self),
+            DaemonMetrics(self.config, self),
+            CgroupSensors(self.config, self),
+            PowerSensors(self.config, self),
+        ]
+        # Names of the scheduled tasks of every consumer, to remove them when it is replaced
+        self.tasks = {}
+        for consumer in self.consumers:
+            self._schedule(consumer)
+        self.discovery = self._create_discovery()
+        self.update_discovery()
+
+    @property
+    def sleep_time(self) -> int:
+        return self.config.update_interval
+
+    @property
+    def resume_check_interval(self) -> float:
+        return self.config.resume_check_interval
 
-        self.consumers: List[MQTTConsumer] = [HostSensors(self.config, self), LinuxCommands(self.config, self)]
+    def _schedule(self, consumer: MQTTConsumer):
+        names = []
+        for task in consumer.scheduled_tasks():
+            try:
+                self.scheduler.add(task, task.interval or self.sleep_time)
+            except ValueError as e:
+                logger.error(f"Not scheduling {task.name}: {e}")
+                continue
+            names.append(task.name)
+        self.tasks[id(consumer)] = names
+
+    def _unschedule(self, consumer: MQTTConsumer):
+        for name in self.tasks.pop(id(consumer), []):
+            self.scheduler.remove(name)
 
     def run(self):
         if self.running:
             return
         self.running = True
+        # Connects in the background, sensors are read and buffered until the broker is reachable
         self._mqtt_connect()
         self.mqtt_client.loop_start()
+        self._start_sleep_monitor()
+        self._start_watchdog()
+        self.notifier.ready()
         try:
-            slept = 0.0
             while self.running:
-                if slept >= self.sleep_time:
-                    slept = 0.0
-                    for consumer in self.consumers:
-                        consumer.update_mqtt(self.mqtt_client)
-                time.sleep(MAIN_LOOP_SLEEP_TIME)
-                slept += MAIN_LOOP_SLEEP_TIME
+                self.check_resume()
+                self._run_calls()
+                self.scheduler.run_pending(self.publisher)
+                if self.running:
+                    # Sleep until the next task is due or we are woken up.
+                    # The wait runs on the monotonic clock, which stops while suspended, so
+                    # without logind telling us about the resume, wake up regularly to compare the clocks.
+                    logind = self.sleep_monitor is not None and self.sleep_monitor.running()
+                    self.scheduler.wait(None if logind else self.resume_check_interval)
         except KeyboardInterrupt:
             logger.info("Exiting")
+        self.notifier.stopping()
+        if self.sleep_monitor is not None:
+            self.sleep_monitor.stop()
         self._disconnect()
+        self.notifier.close()
+
+    def _start_watchdog(self):
+        interval = self.notifier.watchdog_interval()
+        if interval is None:
+            return
+        # Pinged from the main loop, so systemd restarts us if the loop hangs
+        self.scheduler.add(ScheduledTask("watchdog", interval, lambda mqtt_client: self.notifier.watchdog()), interval)
+        logger.info(f"Notifying the systemd watchdog every {interval:.1f} s")
+
+    def on_first_publish(self):
+        """
+        Called by the publisher when the first value reached the MQTT client.
+        """
+        self.first_publish = time.monotonic() - self.started
+        logger.info(f"First value published {self.first_publish:.3f} s after start")
+        self.notifier.status(f"Publishing to {self.config.server}:{self.config.port}")
+
+    def _start_sleep_monitor(self):
+        if not LogindSleepMonitor.available():
+            return
+        # Both callbacks come from the monitor thread and are handed to the main loop
+        monitor = LogindSleepMonitor(
+            lambda: self.call_soon(self.on_suspend), lambda: self.call_soon(self.check_resume, True)
+        )
+        if monitor.start():
+            self.sleep_monitor = monitor
+
+    def check_resume(self, resumed: bool = False):
+        """
+        Calls on_resume if the system was suspended since the last check.
+        resumed is set if we already know from logind that the system just woke up.
+        """
+        suspended = self.suspend_detector.check(resumed)
+        if suspended is None:
+            # Not suspended, or the resume was already handled when the clocks were compared
+            return
+        logger.info(f"System resumed after {suspended:.0f} s of suspend")
+        self.on_resume()
+
+    def call_soon(self, func, *args):
+        """
+        Runs func in the main loop as soon as possible. Safe to call from any thread.
+        """
+        self.calls.put((func, args))
+        self.scheduler.wakeup()
+
+    def _run_calls(self):
+        while True:
+            try:
+                func, args = self.calls.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                func(*args)
+            except Exception as e:
+                logger.error(f"Error running {getattr(func, '__name__', func)}: {e}")
 
     def on_suspend(self):
+        self.suspend_detector.prepare_for_sleep()
         # Set availablity to offline instead of waiting for the last will
-        self._set_offline()
+        info = self._set_offline()
+        if self.sleep_monitor is not None:
+            if info.rc == mqtt.MQTT_ERR_SUCCESS:
+                # logind waits for the delay lock, make sure the message left before releasing it
+                info.wait_for_publish(SUSPEND_PUBLISH_TIMEOUT)
+            self.sleep_monitor.release()
 
     def on_exit(self, *args):
         logger.info("Exit requested")
         self.running = False
+        self.scheduler.wakeup()
+
+    def on_reload(self, *args):
+        # Called from the signal handler, the reload itself runs in the main loop
+        self.call_soon(self.reload)
+
+    def reload(self):
+        """
+        Reads the configuration file again and applies it without dropping the MQTT connection.
+        Only consumers whose configuration changed are replaced, and only changed discovery
+        configs are published.
+        """
+        config = self.settings.reload()
+        if config is None:
+            return
+        old = self.config
+        if config.section("mqtt") != old.section("mqtt") or config.client_name != old.client_name:
+            logger.warning("The MQTT settings or the client name changed, restart linux2mqtt to apply the changes")
+            return
+        logger.info("Reloading configuration")
+        self.notifier.reloading()
+        self.config = config
+        connected = self.mqtt_client is not None and self.mqtt_client.is_connected()
+        interval_changed = config.update_interval != old.update_interval
+        for i, consumer in enumerate(self.consumers):
+            if all(config.section(name) == old.section(name) for name in consumer.config_sections):
+                if interval_changed:
+                    # Tasks on the global update interval need to be rescheduled
+                    self._unschedule(consumer)
+                    self._schedule(consumer)
+                continue
+            logger.info(f"Configuration of {type(consumer).__name__} changed, recreating it")
+            self._unschedule(consumer)
+            if connected:
+                consumer.disconnect(self.mqtt_client)
+            consumer.close()
+            consumer = type(consumer)(config, self)
+            self.consumers[i] = consumer
+            self._schedule(consumer)
+            if connected:
+                consumer.connected(self.mqtt_client)
+        self.refresh_discovery()
+        self.notifier.ready()
 
     def on_resume(self):
-        # This will most likely fail, but if we are not disconnected we set the availability here
+        # If we are still connected we set the availability here
         # If we were disconnected while suspended, we will reconnect and set the availability in the callback
         self._set_online()
+        # The values from before the suspend are outdated, read everything now
+        self.scheduler.run_all_soon()
 
-    def _on_mqtt_connect(self, client, userdata, flags, result_code):
+    def _on_mqtt_connect(self, client, userdata, flags, result_code, properties=None):
         if result_code == 0:
             logger.info("Connected to MQTT server")
+            self.connect_count += 1
+            if self.aliases is not None:
+                # Aliases are per connection, the broker tells how many we may use
+                self.aliases.reset(getattr(properties, "TopicAliasMaximum", 0))
             for consumer in self.consumers:
                 consumer.connected(self.mqtt_client)
+            if self.discovery is not None:
+                self.discovery.on_connect(self.mqtt_client)
             self._set_online()
+            if self.spool is not None:
+                self.spool.replay(self.mqtt_client, timestamps=self.mqtt_v5)
         else:
             # Find the error message from the result code
-            error_message = mqtt.connack_string(result_code)
+            error_message = str(result_code) if self.mqtt_v5 else mqtt.connack_string(result_code)
             logger.error(f"Failed to connect to MQTT server: {error_message}")
 
+    def _on_mqtt_disconnect(self, client, userdata, result_code, properties=None):
+        if self.aliases is not None:
+            # The aliases died with the connection, send full topics until the next connect sets them up again
+            self.aliases.reset(0)
+        if result_code != 0:
+            logger.warning(f"Disconnected from MQTT server ({result_code}), reconnecting")
+
+    def _on_mqtt_connect_fail(self, client, userdata):
+        # paho retries with exponential backoff
+        logger.warning(f"MQTT server {self.config.server}:{self.config.port} not reachable, retrying")
+
+    def _create_discovery(self):
+        if not self.config.homeassistant:
+            logger.info("Homeassistant integration disabled")
+            return None
+        # The node ids of the sensors and of the command buttons, the client name cannot change without a restart
+        client_name = self.config.client_name
+        return DiscoveryPublisher(
+            self.config.section("mqtt").getfloat("discovery_settle_time", 1.0), (client_name, f"{client_name}_commands")
+        )
+
+    def update_discovery(self):
+        """
+        Builds the discovery payloads of all consumers. This is done once, on reconnect
+        only their hashes are compared with the retained configs.
+        """
+        if self.discovery is None:
+            return
+        configs = {}
+        for consumer in self.consumers:
+            configs.update(consumer.discovery_configs())
+        self.discovery.update(configs)
+
+    def refresh_discovery(self):
+        """
+        Rebuilds the discovery payloads after entities were added or removed at runtime
+        and publishes the ones that changed.
+        """
+        self.update_discovery()
+        if self.discovery is not None and self.mqtt_client is not None and self.mqtt_client.is_connected():
+            self.discovery.republish(self.mqtt_client)
+
+    def _create_spool(self):
+        options = self.config.section("mqtt")
+        policy = options.get("offline_buffer", "none").lower()
+        if policy == "none":
+            return None
+        try:
+            size = options.getint("offline_buffer_size", 1000)
+            max_age = options.getfloat("offline_buffer_max_age", 0.0) or None
+            path = options.get("offline_buffer_file")
+            return OfflineSpool(policy, size, path, max_age)
+        except (ValueError, OSError) as e:
+            logger.error(f"Invalid offline buffer configuration, buffering disabled: {e}")
+            return None
+
     def _mqtt_connect(self):
         # Connect to the MQTT server with the settings from the config file
         client_id = f"linux2mqtt@{socket.gethostname()}_{uuid.uuid4()}"
-        self.mqtt_client = mqtt.Client(client_id=client_id, clean_session=True)
-        self.mqtt_client.username_pw_set(
-            self.config.get("mqtt", "user", None), self.config.get("mqtt", "password", None)
-        )
+        if self.mqtt_v5:
+            self.mqtt_client = mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv5)
+        else:
+            self.mqtt_client = mqtt.Client(client_id=client_id, clean_session=True)
+        self.mqtt_client.username_pw_set(self.config.user, self.config.password)
         self.mqtt_client.on_connect = self._on_mqtt_connect
+        self.mqtt_client.on_disconnect = self._on_mqtt_disconnect
+        self.mqtt_client.on_connect_fail = self._on_mqtt_connect_fail
+        options = self.config.section("mqtt")
+        self.mqtt_client.reconnect_delay_set(
+            options.getint("reconnect_min_delay", DEFAULT_RECONNECT_MIN_DELAY),
+            options.getint("reconnect_max_delay", DEFAULT_RECONNECT_MAX_DELAY),
+        )
         # Set the last will to set our availability to offline, this needs to be done before connecting
         self.mqtt_client.will_set(self.availability_topic, "offline", retain=True)
-        self.mqtt_client.connect(
-            self.config.get("mqtt", "server", "localhost"), int(self.config.get("mqtt", "port", 1883)), 60
-        )
+        if self.aliases is not None:
+            # No aliases until the broker announced its TopicAliasMaximum, e.g. after a reload reconnects
+            self.aliases.reset(0)
+        # Does not block, the network thread started by loop_start connects and retries until it succeeds
+        if self.mqtt_v5:
+            self.mqtt_client.connect_async(self.config.server, self.config.port, 60, clean_start=True)
+        else:
+            self.mqtt_client.connect_async(self.config.server, self.config.port, 60)
 
     def _disconnect(self):
         for consumer in self.consumers:
             consumer.disconnect(self.mqtt_client)
+            consumer.close()
         # Set our availability to offline
         self._set_offline()
         self.mqtt_client.disconnect()  # Do this before loop_stop so DISCONNECT is sent
         self.mqtt_client.loop_stop()
+        if self.spool is not None:
+            self.spool.close()
 
     def _set_offline(self):
-        self.mqtt_client.publish(self.availability_topic, "offline", retain=True)
+        return self.mqtt_client.publish(self.availability_topic, "offline", retain=True)
 
     def _set_online(self):
         self.mqtt_client.publish(self.availability_topic, "online", retain=True)
@@ -0,0 +1,61 @@
+import threading
+from typing import Dict, Optional, Tuple
+
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+
+class TopicAliases:
+    """
+    Assigns MQTT v5 topic aliases to the topics of state messages, so only the first
+    publish on a connection sends the full topic and later ones send a two byte alias.
+    Aliases are only valid for one connection and limited by the broker's TopicAliasMaximum,
+    so they are reset on every connect. Optionally sets a message expiry on state messages,
+    so stale readings are not delivered to subscribers that reconnect much later.
+    """
+
+    def __init__(self, use_aliases: bool = True, message_expiry: Optional[int] = None):
+        self.use_aliases = use_aliases
+        self.message_expiry = message_expiry
+        self.maximum = 0
+        self.next_alias = 1
+        # Positive once the broker knows the alias, negative while the full topic still needs to be sent
+        self.aliases: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def reset(self, maximum: int):
+        with self.lock:
+            self.maximum = maximum if self.use_aliases else 0
+            self.next_alias = 1
+            self.aliases = {}
+
+    def prepare(self, topic: str) -> Tuple[str, Optional[Properties], Optional[int]]:
+        """
+        Returns the topic to send, the publish properties and the alias that is established
+        by this message. An alias is only used without the topic once confirm() was called.
+        """
+        properties = Properties(PacketTypes.PUBLISH)
+        if self.message_expiry:
+            properties.MessageExpiryInterval = self.message_expiry
+        with self.lock:
+            alias = self.aliases.get(topic)
+            if alias is None and self.next_alias <= self.maximum:
+                alias = -self.next_alias
+                self.next_alias += 1
+                self.aliases[topic] = alias
+        if alias is None:
+            return topic, properties if self.message_expiry else None, None
+        properties.TopicAlias = abs(alias)
+        if alias > 0:
+            # The broker knows the alias, the topic itself is not sent again
+            return "", properties, None
+        return topic, properties, -alias
+
+    def confirm(self, topic: str, alias: int):
+        """
+        Called once the message establishing the alias was handed to the connection.
+        """
+        with self.lock:
+            # Unless a reconnect reset the aliases in between
+            if self.aliases.get(topic) == -alias:
+                self.aliases[topic] = alias
@@ -4,15 +4,21 @@ from abc import ABC, abstractmethod
 from loguru import logger
 
 
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Dict, List, Tuple
+
+from scheduler import ScheduledTask
 
 if TYPE_CHECKING:
-    from settings import Settings
+    from settings import Config
     from main import Linux2MQTT
 
 
 class MQTTConsumer(ABC):
-    def __init__(self, config: Settings, runtime: Linux2MQTT):
+    # Sections of the configuration file the consumer reads. On reload, the consumer is
+    # only recreated if one of them changed.
+    config_sections: Tuple[str, ...] = ()
+
+    def __init__(self, config: Config, runtime: Linux2MQTT):
         self.availability_topics = []
 
     @abstractmethod
@@ -38,6 +44,28 @@ class MQTTConsumer(ABC):
         """
         pass
 
+    def scheduled_tasks(self) -> List[ScheduledTask]:
+        """
+        Returns the tasks that are run periodically with the MQTT client as argument.
+        By default update_mqtt is run at the global update interval, override this
+        to update parts of the consumer at their own interval.
+        """
+        return [ScheduledTask(type(self).__name__, None, self.update_mqtt)]
+
+    def discovery_configs(self) -> Dict[str, dict]:
+        """
+        Returns the Home Assistant discovery payloads of this consumer by topic.
+        They are published on connect if the Home Assistant integration is enabled,
+        but only if the broker does not have the same config retained already.
+        """
+        return {}
+
+    def close(self):
+        """
+        Releases files, threads and sockets of the consumer when it is replaced or the daemon exits.
+        """
+        pass
+
     def connected(self, mqtt_client):
         """
         Called when the MQTT client connects to the server.
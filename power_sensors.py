@@ -0,0 +1,106 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, List, Set
+
+from loguru import logger
+
+from discovery import sensor_config
+from host_sensors import MQTTSensor, SensorConsumer
+from scheduler import ScheduledTask
+from powerfs import PowerTree
+
+if TYPE_CHECKING:
+    from settings import Config
+    from main import Linux2MQTT
+
+
+class PowerSensors(SensorConsumer):
+    """
+    Publishes the power draw of the RAPL domains (CPU package, cores, DRAM) and the state
+    of batteries and AC adapters.
+    """
+
+    config_sections = ("power",)
+    # All sensors share one refresh of the tree
+    default_workers = 1
+
+    def __init__(self, config: Config, runtime: Linux2MQTT):
+        super().__init__(config, runtime, "power")
+        self.sensors: List[MQTTSensor] = []
+        # Published as binary_sensor instead of sensor
+        self.binary_sensors: Set[str] = set()
+        self.tree = None
+        self.client_name = config.client_name
+        self.publish_topic = config.topic("power", "power")
+        options = self.options
+        self.enabled = options.getbool("enable")
+        if not self.enabled:
+            return
+        self.interval = options.getfloat("update_interval", positive=True)
+        self.tree = PowerTree(options.get("root", "/sys"))
+        self.tree.scan(options.getbool("rapl", True), options.getbool("power_supply", True))
+        self._add_sensors()
+        for sensor in self.sensors:
+            self._setup_sensor(sensor)
+        self._start_collector()
+        logger.info(
+            f"Publishing power of {len(self.tree.domains)} RAPL domains and "
+            f"{len(self.tree.supplies)} power supplies to {self.publish_topic}"
+        )
+
+    def _add_sensor(self, key, unit, func, friendly_name, device_class=None):
+        self.sensors.append(
+            MQTTSensor(
+                key,
+                f"{self.publish_topic}/{key}",
+                unit,
+                "{{ value }}",
+                # One pread per attribute file for the first sensor read in a tick, the others reuse the readings
+                lambda: self.tree.get(lambda tree: func()),
+                f"{self.client_name.title()} {friendly_name}",
+                device_class=device_class,
+            )
+        )
+
+    def _add_sensors(self):
+        for domain in self.tree.domains:
+            label = domain.key.replace("_", " ").title()
+            self._add_sensor(
+                f"rapl_{domain.key}", "W", lambda d=domain: PowerTree.rapl_watts(d), f"{label} Power", "power"
+            )
+        for supply in self.tree.supplies:
+            key = f"power_supply_{supply.key}"
+            files = supply.files
+            if "online" in files and supply.type != "Battery":
+                self._add_sensor(
+                    f"{key}_online", "", lambda s=supply: PowerTree.online(s), f"{supply.name} Plugged In", "plug"
+                )
+                self.binary_sensors.add(f"{key}_online")
+            if "capacity" in files:
+                self._add_sensor(
+                    f"{key}_capacity", "%", lambda s=supply: PowerTree.capacity(s), f"{supply.name} Level", "battery"
+                )
+            if "status" in files:
+                self._add_sensor(f"{key}_status", "", lambda s=supply: PowerTree.status(s), f"{supply.name} Status")
+            if "power_now" in files or {"current_now", "voltage_now"} <= files.keys():
+                self._add_sensor(
+                    f"{key}_power", "W", lambda s=supply: PowerTree.power(s), f"{supply.name} Power", "power"
+                )
+
+    def scheduled_tasks(self):
+        if not self.enabled:
+            return []
+        return [ScheduledTask("power", self.interval, self.update_mqtt)]
+
+    def discovery_configs(self):
+        configs = {}
+        for sensor in self.sensors:
+            component = "binary_sensor" if sensor.name in self.binary_sensors else "sensor"
+            topic, payload = sensor_config(sensor, self.client_name, self.availability_topic, component)
+            configs[topic] = payload
+        return configs
+
+    def close(self):
+        super().close()
+        if self.tree is not None:
+            self.tree.close()
+            self.tree = None
@@ -0,0 +1,181 @@
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from loguru import logger
+
+from sysfs import CachedSnapshot, SysfsFile, open_optional
+
+# Power supply attributes read on every refresh, all others are ignored
+SUPPLY_ATTRIBUTES = ("online", "capacity", "status", "power_now", "current_now", "voltage_now")
+
+
+def _read_text(path: str) -> Optional[str]:
+    # Attributes that never change are read once while scanning
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass
+class RaplDomain:
+    # e.g. package_0 or package_0_core
+    key: str
+    name: str
+    energy: SysfsFile
+    # energy_uj wraps to 0 after this value
+    max_range: int
+    energy_uj: Optional[int] = None
+    watts: Optional[float] = None
+
+
+@dataclass
+class PowerSupply:
+    key: str
+    name: str
+    # Mains, Battery, USB, ...
+    type: str
+    files: Dict[str, SysfsFile] = field(default_factory=dict)
+    values: Dict[str, str] = field(default_factory=dict)
+
+
+class PowerTree(CachedSnapshot):
+    """
+    Reads CPU package power from the powercap RAPL domains and the state of batteries and
+    AC adapters from the power_supply class. The domains and supplies are only looked up
+    once, their attribute files are kept open and re-read with a single pread each.
+    root can point to a fake sysfs tree.
+    """
+
+    def __init__(self, root: str = "/sys", max_age: float = 0.5, clock: Callable[[], float] = time.monotonic):
+        self.root = root.rstrip("/")
+        super().__init__(max_age, clock)
+        self.domains: List[RaplDomain] = []
+        self.supplies: List[PowerSupply] = []
+        self.timestamp: Optional[float] = None
+
+    def scan(self, rapl: bool = True, power_supply: bool = True):
+        if rapl:
+            self._scan_rapl()
+        if power_supply:
+            self._scan_supplies()
+
+    @staticmethod
+    def _list(directory: str) -> List[str]:
+        try:
+            return sorted(os.listdir(directory))
+        except OSError:
+            return []
+
+    def _scan_rapl(self):
+        directory = f"{self.root}/class/powercap"
+        names = {}
+        # intel-rapl:0 is a package, intel-rapl:0:0 one of its subdomains (core, uncore, dram)
+        for entry in self._list(directory):
+            if not re.fullmatch(r"intel-rapl(:\d+)+", entry):
+                continue
+            path = f"{directory}/{entry}"
+            name = re.sub(r"\W", "_", _read_text(f"{path}/name") or entry)
+            parent = entry.rsplit(":", 1)[0]
+            key = f"{names[parent]}_{name}" if parent in names else name
+            names[entry] = key
+            energy = open_optional(f"{path}/energy_uj", 32)
+            if energy is None:
+                logger.warning(f"Cannot read {path}/energy_uj, reading RAPL energy requires root")
+                continue
+            max_range = _int(_read_text(f"{path}/max_energy_range_uj")) or 2**32
+            self.domains.append(RaplDomain(key, name, energy, max_range))
+
+    def _scan_supplies(self):
+        directory = f"{self.root}/class/power_supply"
+        for entry in self._list(directory):
+            path = f"{directory}/{entry}"
+            # Power supplies of HID devices like mice report their own battery, only use the system's ones
+            if _read_text(f"{path}/scope") == "Device":
+                continue
+            supply = PowerSupply(re.sub(r"\W", "_", entry).lower(), entry, _read_text(f"{path}/type") or "Unknown")
+            for attribute in SUPPLY_ATTRIBUTES:
+                file = open_optional(f"{path}/{attribute}", 64)
+                if file is not None:
+                    supply.files[attribute] = file
+            if supply.files:
+                self.supplies.append(supply)
+
+    def refresh(self):
+        # Called with the lock held
+        now = self.clock()
+        elapsed = None if self.timestamp is None else now - self.timestamp
+        for domain in self.domains:
+            try:
+                energy = domain.energy.read_int()
+            except (OSError, ValueError):
+                domain.watts = None
+                continue
+            if domain.energy_uj is not None and elapsed:
+                delta = energy - domain.energy_uj
+                if delta < 0:
+                    # The counter wrapped at max_energy_range_uj
+                    delta += domain.max_range
+                domain.watts = delta / elapsed / 10**6
+            domain.energy_uj = energy
+        for supply in self.supplies:
+            values = {}
+            for attribute, file in supply.files.items():
+                try:
+                    values[attribute] = file.read().decode().strip()
+                except OSError:
+                    # e.g. ENODATA from a battery that is being removed
+                    pass
+            supply.values = values
+        self.timestamp = now
+        self.refreshed = now
+
+    @staticmethod
+    def rapl_watts(domain: RaplDomain) -> Optional[float]:
+        return None if domain.watts is None else round(domain.watts, 2)
+
+    @staticmethod
+    def online(supply: PowerSupply) -> Optional[str]:
+        value = supply.values.get("online")
+        return None if value is None else ("ON" if value == "1" else "OFF")
+
+    @staticmethod
+    def capacity(supply: PowerSupply) -> Optional[int]:
+        return _int(supply.values.get("capacity"))
+
+    @staticmethod
+    def status(supply: PowerSupply) -> Optional[str]:
+        return supply.values.get("status")
+
+    @staticmethod
+    def power(supply: PowerSupply) -> Optional[float]:
+        # In W, from µW or from µA and µV if the driver does not report the power
+        values = supply.values
+        power = _int(values.get("power_now"))
+        if power is not None:
+            return round(power / 10**6, 2)
+        current, voltage = _int(values.get("current_now")), _int(values.get("voltage_now"))
+        if current is None or voltage is None:
+            return None
+        return round(current * voltage / 10**12, 2)
+
+    def close(self):
+        with self.lock:
+            for domain in self.domains:
+                domain.energy.close()
+            for supply in self.supplies:
+                for file in supply.files.values():
+                    file.close()
+            self.domains = []
+            self.supplies = []
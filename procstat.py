@@ -0,0 +1,159 @@
+import math
+import time
+from array import array
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sysfs import CachedSnapshot, SysfsFile
+
+# Fields of a cpu line in /proc/stat, guest times are already included in user and nice
+CPU_FIELDS = ("user", "nice", "system", "idle", "iowait", "irq", "softirq", "steal", "guest", "guest_nice")
+NUM_FIELDS = len(CPU_FIELDS)
+IDLE, IOWAIT, STEAL = CPU_FIELDS.index("idle"), CPU_FIELDS.index("iowait"), CPU_FIELDS.index("steal")
+# Fields summed up for the total time, guest and guest_nice are part of user and nice
+TOTAL_FIELDS = CPU_FIELDS.index("guest")
+
+MEMINFO_KEYS = (b"MemTotal", b"MemAvailable", b"SwapTotal", b"SwapFree")
+
+
+class ProcSnapshot(CachedSnapshot):
+    """
+    Reads /proc/stat, /proc/meminfo and /proc/loadavg once per tick through kept-open files
+    and derives all CPU, memory and load values from that single snapshot.
+    CPU counters are stored in two preallocated arrays (current and previous sample) that are
+    swapped on every refresh, so computing the deltas of all cores is a single pass without
+    allocating per-core objects. Sensors read their values through get(), which refreshes the
+    snapshot if it is older than max_age, so sensors updated in the same tick share one read.
+    """
+
+    def __init__(self, proc: str = "/proc", max_age: float = 0.5, clock: Callable[[], float] = time.monotonic):
+        self.stat = SysfsFile(f"{proc}/stat", 16384)
+        self.meminfo = SysfsFile(f"{proc}/meminfo", 8192)
+        self.loadavg = SysfsFile(f"{proc}/loadavg", 128)
+        super().__init__(max_age, clock)
+        self.rows = 0
+        # The first field of every cpu line, to notice CPUs going on- or offline
+        self.names: List[bytes] = []
+        # Row of every CPU number, offline CPUs have no line, so cpu3 is not always the fourth core
+        self.core_rows: Dict[int, int] = {}
+        self.current = array("Q")
+        self.previous = array("Q")
+        # Per row (aggregate first, then every core): busy, iowait and steal in percent,
+        # NaN until two samples of the same set of CPUs were taken some time apart
+        self.usage = array("d")
+        self.iowait = array("d")
+        self.steal = array("d")
+        self.memory: Dict[bytes, int] = {}
+        self.load: Tuple[float, float, float] = (0.0, 0.0, 0.0)
+        # Take the first sample now, so the first refresh already yields usage values
+        self._read_stat()
+
+    @property
+    def cores(self) -> List[int]:
+        return sorted(self.core_rows)
+
+    def _resize(self, names: List[bytes]):
+        rows = len(names)
+        self.rows = rows
+        self.names = names
+        self.core_rows = {int(name[3:]): row for row, name in enumerate(names) if name != b"cpu"}
+        zeros = bytes(8 * rows * NUM_FIELDS)
+        self.current = array("Q", zeros)
+        self.previous = array("Q", zeros)
+        self.usage = array("d", [math.nan]) * rows
+        self.iowait = array("d", [math.nan]) * rows
+        self.steal = array("d", [math.nan]) * rows
+
+    def _read_stat(self) -> bool:
+        data = self.stat.read()
+        # Only the cpu lines at the top are needed, skip the long intr and softirq lines
+        end = data.find(b"\nintr")
+        lines = data[: end if end >= 0 else len(data)].split(b"\n")
+        lines = [line for line in lines if line.startswith(b"cpu")]
+        names = [line.split(None, 1)[0] for line in lines]
+        resized = names != self.names
+        if resized:
+            # CPUs went on- or offline, deltas of this sample are meaningless
+            self._resize(names)
+        current = self.current
+        for row, line in enumerate(lines):
+            values = line.split()[1 : NUM_FIELDS + 1]
+            offset = row * NUM_FIELDS
+            for i, value in enumerate(values):
+                current[offset + i] = int(value)
+        return not resized
+
+    def _compute_cpu(self):
+        current, previous = self.current, self.previous
+        # One pass over the counters of all rows. A counter can go backwards, iowait in particular
+        # is not monotonic, so a negative delta counts as no time spent
+        deltas = [c - p if c > p else 0 for c, p in zip(current, previous)]
+        for row in range(self.rows):
+            offset = row * NUM_FIELDS
+            total = sum(deltas[offset : offset + TOTAL_FIELDS])
+            if total <= 0:
+                # No tick elapsed since the last sample, keep the last values
+                continue
+            idle = deltas[offset + IDLE] + deltas[offset + IOWAIT]
+            self.usage[row] = (total - idle) * 100 / total
+            self.iowait[row] = deltas[offset + IOWAIT] * 100 / total
+            self.steal[row] = deltas[offset + STEAL] * 100 / total
+
+    def _read_meminfo(self):
+        memory = {}
+        for line in self.meminfo.read().split(b"\n"):
+            key, _, value = line.partition(b":")
+            if key in MEMINFO_KEYS:
+                memory[key] = int(value.split()[0])
+        self.memory = memory
+
+    def _read_loadavg(self):
+        fields = self.loadavg.read().split()
+        self.load = (float(fields[0]), float(fields[1]), float(fields[2]))
+
+    def refresh(self):
+        # Keep the previous sample and read the new one into the other buffer
+        self.previous, self.current = self.current, self.previous
+        if self._read_stat():
+            self._compute_cpu()
+        self._read_meminfo()
+        self._read_loadavg()
+        self.refreshed = self.clock()
+
+    @staticmethod
+    def _percent(values: array, row: int) -> Optional[float]:
+        if row >= len(values) or math.isnan(values[row]):
+            return None
+        return round(values[row], 1)
+
+    def cpu_usage(self, core: int = None) -> Optional[float]:
+        if core is None:
+            return self._percent(self.usage, 0)
+        row = self.core_rows.get(core)
+        return None if row is None else self._percent(self.usage, row)
+
+    def cpu_iowait(self) -> Optional[float]:
+        return self._percent(self.iowait, 0)
+
+    def cpu_steal(self) -> Optional[float]:
+        return self._percent(self.steal, 0)
+
+    def memory_used_percent(self) -> Optional[float]:
+        total = self.memory.get(b"MemTotal")
+        if not total:
+            return None
+        return round((total - self.memory.get(b"MemAvailable", total)) * 100 / total, 1)
+
+    def memory_available(self) -> Optional[float]:
+        # In MiB, meminfo reports KiB
+        available = self.memory.get(b"MemAvailable")
+        return None if available is None else round(available / 1024, 1)
+
+    def swap_used_percent(self) -> Optional[float]:
+        total = self.memory.get(b"SwapTotal")
+        if not total:
+            return None
+        return round((total - self.memory.get(b"SwapFree", total)) * 100 / total, 1)
+
+    def close(self):
+        for file in (self.stat, self.meminfo, self.loadavg):
+            file.close()
@@ -0,0 +1,140 @@
+import heapq
+import os
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+from sysfs import CachedSnapshot
+
+# psutil compatible names of the process states in /proc/<pid>/stat
+STATUS = {
+    "R": "running",
+    "S": "sleeping",
+    "D": "disk-sleep",
+    "T": "stopped",
+    "t": "tracing-stop",
+    "Z": "zombie",
+    "X": "dead",
+    "I": "idle",
+    "P": "parked",
+    "W": "waking",
+}
+# The kernel truncates the command name in /proc/<pid>/stat to this length
+COMM_LENGTH = 15
+# Upper bound of cached full process names
+MAX_FULL_NAMES = 1024
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+@dataclass
+class ProcessEntry:
+    pid: int
+    name: str
+    state: str
+    start_time: int
+    cpu_ticks: int
+    rss: int
+    cpu_percent: float = 0.0
+
+    @property
+    def status(self) -> str:
+        return STATUS.get(self.state, self.state)
+
+
+class ProcessTable(CachedSnapshot):
+    """
+    PID-keyed table of all processes, updated incrementally from /proc/<pid>/stat.
+    Every refresh reads only the stat file of each process, computes the CPU usage
+    from the previous CPU times of the same process (the start time tells reused
+    PIDs apart) and evicts processes that exited. The top N are selected with a heap.
+    """
+
+    def __init__(self, proc: str = "/proc", max_age: float = 0.5, clock: Callable[[], float] = time.monotonic):
+        self.proc = proc
+        super().__init__(max_age, clock)
+        self.entries: Dict[int, ProcessEntry] = {}
+        self.full_names: Dict[tuple, str] = {}
+
+    def _read_stat(self, pid: int) -> Optional[ProcessEntry]:
+        try:
+            fd = os.open(f"{self.proc}/{pid}/stat", os.O_RDONLY)
+            try:
+                data = os.read(fd, 1024)
+            finally:
+                os.close(fd)
+        except OSError:
+            # The process exited
+            return None
+        # The command name is in parentheses and may itself contain spaces and parentheses
+        open_paren = data.find(b"(")
+        close_paren = data.rfind(b")")
+        fields = data[close_paren + 2 :].split(b" ", 22)
+        # Fields after the name: state is 3, utime 14, stime 15, starttime 22, rss 24 (counted from 1 in proc(5))
+        return ProcessEntry(
+            pid,
+            data[open_paren + 1 : close_paren].decode(errors="replace"),
+            fields[0].decode(),
+            int(fields[19]),
+            int(fields[11]) + int(fields[12]),
+            int(fields[21]) * PAGE_SIZE,
+        )
+
+    def refresh(self):
+        now = self.clock()
+        elapsed = now - self.refreshed if self.refreshed is not None else None
+        previous = self.entries
+        entries = {}
+        for name in os.listdir(self.proc):
+            if not name.isdigit():
+                continue
+            entry = self._read_stat(int(name))
+            if entry is None:
+                continue
+            last = previous.get(entry.pid)
+            if elapsed and last is not None and last.start_time == entry.start_time:
+                entry.cpu_percent = (entry.cpu_ticks - last.cpu_ticks) / CLOCK_TICKS / elapsed * 100
+            entries[entry.pid] = entry
+        # Exited processes are dropped by not carrying them over
+        self.entries = entries
+        self.full_names = {key: name for key, name in self.full_names.items() if key[0] in entries}
+        self.refreshed = now
+
+    def full_name(self, entry: ProcessEntry) -> str:
+        """
+        Returns the name of the process, completed from the command line if the kernel truncated it.
+        """
+        if len(entry.name) < COMM_LENGTH:
+            return entry.name
+        key = (entry.pid, entry.start_time)
+        name = self.full_names.get(key)
+        if name is None:
+            name = entry.name
+            try:
+                with open(f"{self.proc}/{entry.pid}/cmdline", "rb") as f:
+                    executable = os.path.basename(f.read().split(b"\0", 1)[0]).decode(errors="replace")
+                if executable.startswith(entry.name):
+                    name = executable
+            except OSError:
+                pass
+            if len(self.full_names) >= MAX_FULL_NAMES:
+                # Only pruned on refresh, which might never happen if just single processes are described
+                self.full_names.clear()
+            self.full_names[key] = name
+        return name
+
+    def top_cpu(self, count: int) -> List[ProcessEntry]:
+        return heapq.nlargest(count, self.entries.values(), key=lambda entry: entry.cpu_percent)
+
+    def top_rss(self, count: int) -> List[ProcessEntry]:
+        return heapq.nlargest(count, self.entries.values(), key=lambda entry: entry.rss)
+
+    def describe(self, pid: int) -> Optional[str]:
+        """
+        Returns "name (status)" of a single process, reading only its own stat file.
+        """
+        entry = self._read_stat(pid)
+        if entry is None:
+            return None
+        with self.lock:
+            return f"{self.full_name(entry)} ({entry.status})"
@@ -0,0 +1,50 @@
+from dataclasses import dataclass, field
+from numbers import Real
+from typing import Any, Optional
+
+
+@dataclass
+class PublishFilter:
+    """
+    Decides if a sensor value needs to be published.
+    Numeric values are suppressed while they stay within the absolute and/or
+    relative (percent of the last published value) deadband, all other values
+    while they are equal to the last published one. An unchanged value is
+    published again once it is older than max_age seconds.
+    """
+
+    deadband: float = 0.0
+    deadband_percent: float = 0.0
+    max_age: Optional[float] = None
+    last_value: Any = field(default=None, init=False)
+    last_publish: Optional[float] = field(default=None, init=False)
+
+    def changed(self, value) -> bool:
+        last = self.last_value
+        if last is None:
+            return True
+        numeric = isinstance(value, Real) and isinstance(last, Real) and not isinstance(value, bool)
+        if not numeric:
+            return value != last
+        delta = abs(value - last)
+        if self.deadband == 0.0 and self.deadband_percent == 0.0:
+            return delta != 0
+        if self.deadband and delta > self.deadband:
+            return True
+        if self.deadband_percent and delta > abs(last) * self.deadband_percent / 100:
+            return True
+        return False
+
+    def should_publish(self, value, now: float) -> bool:
+        if self.changed(value):
+            return True
+        return self.max_age is not None and now - self.last_publish >= self.max_age
+
+    def published(self, value, now: float):
+        self.last_value = value
+        self.last_publish = now
+
+    def reset(self):
+        # Force the next value to be published, e.g. after reconnecting
+        self.last_value = None
+        self.last_publish = None
@@ -0,0 +1,47 @@
+import math
+import threading
+from array import array
+from typing import Dict, Optional
+
+
+class SampleBuffer:
+    """
+    Fixed size ring buffer of float samples taken between two publishes.
+    The samples live in a preallocated array, adding one never allocates.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, capacity)
+        self.values = array("d", bytes(8 * self.capacity))
+        self.count = 0
+        self.position = 0
+        self.lock = threading.Lock()
+
+    def add(self, value):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return
+        with self.lock:
+            self.values[self.position] = value
+            self.position = (self.position + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+
+    def aggregate(self, clear: bool = True) -> Optional[Dict[str, float]]:
+        """
+        Returns min, max, mean and 95th percentile of the samples, None if there are none.
+        """
+        with self.lock:
+            if not self.count:
+                return None
+            samples = sorted(self.values[: self.count])
+            if clear:
+                self.count = 0
+                self.position = 0
+        # Nearest rank percentile
+        p95 = samples[max(math.ceil(0.95 * len(samples)) - 1, 0)]
+        return {
+            "min": round(samples[0], 2),
+            "max": round(samples[-1], 2),
+            "mean": round(sum(samples) / len(samples), 2),
+            "p95": round(p95, 2),
+            "samples": len(samples),
+        }
@@ -0,0 +1,123 @@
+import heapq
+import itertools
+import math
+import os
+import select
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from loguru import logger
+
+
+@dataclass
+class ScheduledTask:
+    name: str
+    # Interval in seconds, None to use the global update interval
+    interval: Optional[float]
+    func: Callable
+
+
+@dataclass(order=True)
+class _Entry:
+    due: float
+    seq: int
+    interval: float = field(compare=False)
+    task: ScheduledTask = field(compare=False)
+
+
+class Scheduler:
+    """
+    Runs tasks at fixed intervals on the monotonic clock.
+    Deadlines are kept in a heap and advanced by whole intervals, so the
+    cadence does not drift with the time spent running the tasks.
+    The process sleeps until the next deadline or until wakeup() is called,
+    which is safe from other threads and from signal handlers.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.heap: List[_Entry] = []
+        self.counter = itertools.count()
+        # Instrumentation of the last tick that ran any task
+        self.lag = 0.0
+        self.tick_duration = 0.0
+        self.task_durations: Dict[str, float] = {}
+        self.wakeup_read, self.wakeup_write = os.pipe()
+        os.set_blocking(self.wakeup_read, False)
+        os.set_blocking(self.wakeup_write, False)
+
+    def add(self, task: ScheduledTask, interval: float, delay: float = 0.0):
+        # A zero interval would divide by zero in run_pending, a negative one never advance the deadline
+        if not interval or interval <= 0:
+            raise ValueError(f"Invalid interval for task {task.name}: {interval}")
+        heapq.heappush(self.heap, _Entry(self.clock() + delay, next(self.counter), interval, task))
+
+    def remove(self, name: str):
+        self.heap = [entry for entry in self.heap if entry.task.name != name]
+        heapq.heapify(self.heap)
+
+    def run_all_soon(self):
+        """
+        Makes all tasks due now, e.g. to publish fresh values after resuming from suspend.
+        """
+        now = self.clock()
+        for entry in self.heap:
+            entry.due = min(entry.due, now)
+        heapq.heapify(self.heap)
+
+    def next_due(self) -> Optional[float]:
+        return self.heap[0].due if self.heap else None
+
+    def run_pending(self, *args):
+        now = self.clock()
+        if not self.heap or self.heap[0].due > now:
+            return
+        # How late we woke up for the earliest task
+        self.lag = now - self.heap[0].due
+        while self.heap and self.heap[0].due <= now:
+            entry = self.heap[0]
+            start = self.clock()
+            try:
+                entry.task.func(*args)
+            except Exception as e:
+                logger.error(f"Error running task {entry.task.name}: {e}")
+            end = self.clock()
+            self.task_durations[entry.task.name] = end - start
+            # Advance by whole intervals, skipping the ones we missed instead of running them in a burst
+            missed = math.floor((end - entry.due) / entry.interval)
+            entry.due += entry.interval * (max(missed, 0) + 1)
+            heapq.heapreplace(self.heap, entry)
+        self.tick_duration = self.clock() - now
+
+    def wait(self, max_wait: Optional[float] = None):
+        due = self.next_due()
+        timeout = max_wait
+        if due is not None:
+            timeout = max(0.0, due - self.clock())
+            if max_wait is not None:
+                timeout = min(timeout, max_wait)
+        try:
+            ready, _, _ = select.select([self.wakeup_read], [], [], timeout)
+        except InterruptedError:
+            return
+        if ready:
+            self._drain()
+
+    def wakeup(self):
+        try:
+            os.write(self.wakeup_write, b"\0")
+        except BlockingIOError:
+            # The pipe is full, a wakeup is already pending
+            pass
+
+    def _drain(self):
+        try:
+            while os.read(self.wakeup_read, 512):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        os.close(self.wakeup_read)
+        os.close(self.wakeup_write)
@@ -1,14 +1,120 @@
 import os
+import socket
 import sys
 import argparse
-from configparser import ConfigParser, NoSectionError, NoOptionError
+from configparser import ConfigParser
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Mapping, Optional
+
+from loguru import logger
+
+
+@dataclass(frozen=True)
+class Section:
+    """
+    Read-only view of one section of the configuration file.
+    Consumers convert the values they need once when they are created, never per tick.
+    """
+
+    name: str
+    options: Mapping[str, str] = field(default_factory=lambda: MappingProxyType({}))
+
+    def get(self, key: str, default: str = None) -> Optional[str]:
+        return self.options.get(key, default)
+
+    def getbool(self, key: str, default: bool = False) -> bool:
+        value = self.options.get(key)
+        if value is None:
+            return default
+        return value.strip().lower() == "true"
+
+    def getint(self, key: str, default: Optional[int] = None, positive: bool = False) -> Optional[int]:
+        value = self.options.get(key)
+        if value is None:
+            return default
+        try:
+            number = int(value)
+            if positive and number <= 0:
+                raise ValueError
+        except ValueError:
+            logger.error(f"Invalid value for {key} in [{self.name}]: {value}")
+            return default
+        return number
+
+    def getfloat(self, key: str, default: Optional[float] = None, positive: bool = False) -> Optional[float]:
+        value = self.options.get(key)
+        if value is None:
+            return default
+        try:
+            number = float(value)
+            if positive and number <= 0:
+                raise ValueError
+        except ValueError:
+            logger.error(f"Invalid value for {key} in [{self.name}]: {value}")
+            return default
+        return number
+
+
+@dataclass(frozen=True)
+class Config:
+    """
+    Immutable, validated snapshot of the configuration file with the topics prebuilt.
+    A reload creates a new snapshot, so a snapshot never changes while it is used.
+    """
+
+    server: str
+    port: int
+    user: Optional[str]
+    password: Optional[str]
+    homeassistant: bool
+    client_name: str
+    update_interval: int
+    resume_check_interval: float
+    # <topic>/<client name>
+    base_topic: str
+    availability_topic: str
+    sections: Mapping[str, Section]
+
+    @classmethod
+    def from_parser(cls, parser: ConfigParser) -> "Config":
+        sections = MappingProxyType(
+            {name: Section(name, MappingProxyType(dict(parser.items(name)))) for name in parser.sections()}
+        )
+        empty = Section("")
+        mqtt = sections.get("mqtt", empty)
+        client = sections.get("client", empty)
+        client_name = client.get("name", socket.gethostname())
+        base_topic = f"{mqtt.get('topic', 'linux2mqtt')}/{client_name}"
+        return cls(
+            server=mqtt.get("server", "localhost"),
+            port=mqtt.getint("port", 1883),
+            user=mqtt.get("user"),
+            password=mqtt.get("password"),
+            homeassistant=mqtt.getbool("homeassistant"),
+            client_name=client_name,
+            update_interval=client.getint("update_interval", 60, positive=True),
+            resume_check_interval=client.getfloat("resume_check_interval", 5.0, positive=True),
+            base_topic=base_topic,
+            availability_topic=f"{base_topic}/availability",
+            sections=sections,
+        )
+
+    def section(self, name: str) -> Section:
+        return self.sections.get(name) or Section(name)
+
+    def topic(self, section: str, default_sub_topic: str) -> str:
+        """
+        Returns the topic of a consumer, <topic>/<client name>/<sub_topic of the section>.
+        """
+        return f"{self.base_topic}/{self.section(section).get('sub_topic', default_sub_topic)}"
 
 
 class Settings:
-    def __init__(self):
+    def __init__(self, args=None):
         self.parser = argparse.ArgumentParser()
         self.parser.add_argument("-c", "--config", help="configuration file", default="/etc/linux2mqtt.conf")
-        self.args = self.parser.parse_args()
+        self.args = self.parser.parse_args(args)
         if not os.path.exists(self.args.config):
             sys.stderr.write(f"Configuration file {self.args.config} not found.\n")
             exit(1)
@@ -19,11 +125,20 @@ class Settings:
             sys.stderr.write(f"Error reading configuration file at {self.args.config}: {e}\n")
             exit(1)
 
-    def get(self, section, key, default=None):
-        try:
-            return self.config.get(section, key)
-        except (NoSectionError, NoOptionError):
-            return default
+    def snapshot(self) -> Config:
+        return Config.from_parser(self.config)
 
-    def get_section(self, section):
-        return self.config.items(section)
+    def reload(self) -> Optional[Config]:
+        """
+        Reads the configuration file again and returns the new snapshot.
+        On errors the current configuration is kept and None is returned.
+        """
+        config = ConfigParser()
+        try:
+            if not config.read(self.args.config):
+                raise OSError("file not found")
+        except Exception as e:
+            logger.error(f"Error reading configuration file at {self.args.config}, keeping the current one: {e}")
+            return None
+        self.config = config
+        return self.snapshot()
@@ -0,0 +1,246 @@
+from __future__ import annotations
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Iterator, List, Optional
+
+from loguru import logger
+from paho.mqtt import client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+from mqtt5 import TopicAliases
+
+if TYPE_CHECKING:
+    from main import Linux2MQTT
+
+# Keep the latest message per topic, all messages in order, or drop everything while offline
+POLICY_LATEST = "latest"
+POLICY_ALL = "all"
+POLICY_DROP = "drop"
+POLICIES = (POLICY_LATEST, POLICY_ALL, POLICY_DROP)
+
+
+@dataclass
+class SpooledMessage:
+    timestamp: float
+    topic: str
+    payload: bytes
+    retain: bool
+
+    def to_json(self) -> str:
+        # latin-1 maps every byte to one code point, so any payload survives the round trip
+        return json.dumps([self.timestamp, self.topic, self.payload.decode("latin-1"), self.retain])
+
+    @classmethod
+    def from_json(cls, line: str) -> SpooledMessage:
+        timestamp, topic, payload, retain = json.loads(line)
+        return cls(timestamp, topic, payload.encode("latin-1"), retain)
+
+
+def _to_bytes(payload) -> bytes:
+    if payload is None:
+        return b""
+    if isinstance(payload, bytes):
+        return payload
+    return str(payload).encode()
+
+
+class OfflineSpool:
+    """
+    Bounded buffer for messages published while the broker is unreachable.
+    Messages are kept in memory, or appended to a file if a path is given. The
+    file is compacted according to the policy once it holds twice the allowed
+    number of messages, so neither memory nor disk use grow during long outages.
+    Once a message was buffered, all later ones are buffered as well until the
+    replay after reconnecting has finished, so buffered values never arrive after
+    newer ones on the same topic.
+    """
+
+    def __init__(self, policy: str = POLICY_LATEST, max_messages: int = 1000, path: str = None, max_age: float = None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown offline buffer policy '{policy}', expected one of {', '.join(POLICIES)}")
+        self.policy = policy
+        self.max_messages = max_messages
+        self.path = path
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.dropped = 0
+        # Set while buffered messages wait to be replayed
+        self.holding = False
+        self.latest: OrderedDict[str, SpooledMessage] = OrderedDict()
+        self.all: deque = deque(maxlen=max_messages)
+        self.file = None
+        self.file_count = 0
+        if path:
+            self.file = open(path, "a+")
+            self.file.seek(0)
+            self.file_count = sum(1 for _ in self.file)
+            if self.file_count:
+                logger.info(f"Found {self.file_count} buffered messages in {path}")
+                self.holding = True
+
+    def __len__(self):
+        if self.file is not None:
+            return self.file_count
+        return len(self.latest) if self.policy == POLICY_LATEST else len(self.all)
+
+    def add(self, topic: str, payload, retain: bool = False):
+        if self.policy == POLICY_DROP:
+            self.dropped += 1
+            return
+        with self.lock:
+            self._add(topic, payload, retain)
+
+    def add_if_holding(self, topic: str, payload, retain: bool = False) -> bool:
+        """
+        Buffers the message if earlier messages still wait to be replayed. Returns True if it was buffered.
+        """
+        with self.lock:
+            if not self.holding:
+                return False
+            self._add(topic, payload, retain)
+            return True
+
+    def _add(self, topic: str, payload, retain: bool):
+        # Called with the lock held
+        message = SpooledMessage(time.time(), topic, _to_bytes(payload), retain)
+        self.holding = True
+        if self.file is not None:
+            self.file.write(message.to_json() + "\n")
+            self.file.flush()
+            self.file_count += 1
+            if self.file_count >= 2 * self.max_messages:
+                self._compact()
+        elif self.policy == POLICY_LATEST:
+            self.latest[topic] = message
+            self.latest.move_to_end(topic)
+            if len(self.latest) > self.max_messages:
+                self.latest.popitem(last=False)
+                self.dropped += 1
+        else:
+            if len(self.all) == self.max_messages:
+                self.dropped += 1
+            self.all.append(message)
+
+    def _apply_policy(self, messages: Iterator[SpooledMessage]) -> List[SpooledMessage]:
+        if self.policy == POLICY_LATEST:
+            latest = OrderedDict()
+            for message in messages:
+                latest[message.topic] = message
+                latest.move_to_end(message.topic)
+            return list(latest.values())[-self.max_messages :]
+        return list(deque(messages, maxlen=self.max_messages))
+
+    def _read_file(self) -> Iterator[SpooledMessage]:
+        self.file.seek(0)
+        for line in self.file:
+            try:
+                yield SpooledMessage.from_json(line)
+            except (ValueError, TypeError):
+                # A partially written line after a crash
+                continue
+
+    def _compact(self):
+        messages = self._apply_policy(self._read_file())
+        self.dropped += self.file_count - len(messages)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            f.writelines(message.to_json() + "\n" for message in messages)
+        os.replace(tmp, self.path)
+        self.file.close()
+        self.file = open(self.path, "a+")
+        self.file_count = len(messages)
+
+    def drain(self) -> List[SpooledMessage]:
+        """
+        Removes and returns the buffered messages that are not older than max_age, oldest first.
+        Stops holding back new messages once there is nothing left to replay.
+        """
+        with self.lock:
+            if not len(self):
+                self.holding = False
+                return []
+            if self.file is not None:
+                messages = self._apply_policy(self._read_file())
+                self.file.truncate(0)
+                self.file_count = 0
+            elif self.policy == POLICY_LATEST:
+                messages = list(self.latest.values())
+                self.latest.clear()
+            else:
+                messages = list(self.all)
+                self.all.clear()
+        if self.max_age:
+            oldest = time.time() - self.max_age
+            messages = [message for message in messages if message.timestamp >= oldest]
+        return messages
+
+    def replay(self, mqtt_client, timestamps: bool = False):
+        """
+        Publishes the buffered messages, oldest first, including those buffered while replaying.
+        With timestamps (MQTT 5 only), the time each message was originally published is sent
+        along as "timestamp" user property.
+        """
+        count = 0
+        while self.holding and mqtt_client.is_connected():
+            messages = self.drain()
+            count += len(messages)
+            for message in messages:
+                properties = None
+                if timestamps:
+                    properties = Properties(PacketTypes.PUBLISH)
+                    published = datetime.fromtimestamp(message.timestamp, timezone.utc)
+                    properties.UserProperty = ("timestamp", published.isoformat(timespec="milliseconds"))
+                mqtt_client.publish(message.topic, message.payload, retain=message.retain, properties=properties)
+        if self.dropped:
+            logger.info(f"Dropped {self.dropped} messages while offline")
+            self.dropped = 0
+        if count:
+            logger.info(f"Published {count} messages buffered while offline")
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class BufferedClient:
+    """
+    Wraps the runtime's MQTT client and puts messages into the offline spool
+    instead of paho's unbounded queue while not connected. With MQTT v5, state
+    messages are sent with topic aliases and message expiry.
+    Everything except publish is passed through to the client.
+    """
+
+    def __init__(self, runtime: Linux2MQTT, spool: Optional[OfflineSpool], aliases: Optional[TopicAliases] = None):
+        self.runtime = runtime
+        self.spool = spool
+        self.aliases = aliases
+
+    def publish(self, topic, payload=None, qos=0, retain=False, **kwargs):
+        client = self.runtime.mqtt_client
+        if not client.is_connected():
+            if self.spool is not None:
+                self.spool.add(topic, payload, retain)
+                return None
+        elif self.spool is not None and self.spool.add_if_holding(topic, payload, retain):
+            # Connected, but the buffered messages are not replayed yet
+            return None
+        elif self.runtime.first_publish is None and not retain:
+            self.runtime.on_first_publish()
+        if self.aliases is None or retain or kwargs:
+            # Retained messages like discovery configs are published once, they do not get an alias
+            return client.publish(topic, payload, qos, retain, **kwargs)
+        send_topic, properties, alias = self.aliases.prepare(topic)
+        info = client.publish(send_topic, payload, qos, retain, properties=properties)
+        if alias is not None and info.rc == mqtt.MQTT_ERR_SUCCESS:
+            self.aliases.confirm(topic, alias)
+        return info
+
+    def __getattr__(self, name):
+        return getattr(self.runtime.mqtt_client, name)
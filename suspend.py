@@ -0,0 +1,161 @@
+import shutil
+import subprocess
+import threading
+import time
+from typing import Callable, Optional
+
+from loguru import logger
+
+
+def boottime() -> float:
+    return time.clock_gettime(time.CLOCK_BOOTTIME)
+
+
+class SuspendDetector:
+    """
+    Detects that the system was suspended since the last check.
+    CLOCK_MONOTONIC stops while the system is suspended and CLOCK_BOOTTIME does not,
+    so the difference between both clocks grows by exactly the time spent suspended.
+    Every suspend is reported once, whether the clocks or logind notice the resume first.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 2.0,
+        boottime: Callable[[], float] = boottime,
+        monotonic: Callable[[], float] = time.monotonic,
+    ):
+        self.threshold = threshold
+        self.boottime = boottime
+        self.monotonic = monotonic
+        self.offset = self._offset()
+        # Set when logind announced a suspend that was not reported as resumed yet
+        self.sleeping = False
+
+    def _offset(self) -> float:
+        return self.boottime() - self.monotonic()
+
+    def prepare_for_sleep(self):
+        self.sleeping = True
+
+    def check(self, woke: bool = False) -> Optional[float]:
+        """
+        Returns the number of seconds the system was suspended since the last check,
+        or None if it was not suspended for at least the threshold.
+        woke is set if logind reported the wakeup, then a suspend announced with
+        prepare_for_sleep is reported even if it was shorter than the threshold,
+        unless it was already reported.
+        """
+        offset = self._offset()
+        suspended = offset - self.offset
+        self.offset = offset
+        if suspended < self.threshold and not (woke and self.sleeping):
+            return None
+        self.sleeping = False
+        return suspended
+
+
+class LogindSleepMonitor:
+    """
+    Watches logind's PrepareForSleep signal with gdbus and calls on_sleep before the
+    system suspends and on_wake right after it resumed. This also covers suspends
+    that were not triggered by us, e.g. closing the lid.
+    If systemd-inhibit is installed, a delay inhibitor lock is held while the system is
+    awake, so logind waits with the suspend until release() was called, at most
+    InhibitDelayMaxSec (5 s by default).
+    """
+
+    COMMAND = [
+        "gdbus",
+        "monitor",
+        "--system",
+        "--dest",
+        "org.freedesktop.login1",
+        "--object-path",
+        "/org/freedesktop/login1",
+    ]
+    # The lock is held as long as cat runs, which exits when we do because its stdin closes
+    INHIBIT_COMMAND = [
+        "systemd-inhibit",
+        "--what=sleep",
+        "--mode=delay",
+        "--who=linux2mqtt",
+        "--why=Publishing the availability before the system sleeps",
+        "cat",
+    ]
+
+    def __init__(self, on_sleep: Callable[[], None], on_wake: Callable[[], None]):
+        self.on_sleep = on_sleep
+        self.on_wake = on_wake
+        self.process = None
+        self.thread = None
+        self.inhibitor = None
+        self.inhibit_lock = threading.Lock()
+
+    @staticmethod
+    def available() -> bool:
+        return shutil.which("gdbus") is not None
+
+    def start(self):
+        try:
+            self.process = subprocess.Popen(
+                self.COMMAND, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL
+            )
+        except OSError as e:
+            logger.warning(f"Cannot monitor logind for suspend: {e}")
+            return False
+        self.thread = threading.Thread(target=self._run, name="logind-monitor", daemon=True)
+        self.thread.start()
+        self._inhibit()
+        return True
+
+    def running(self) -> bool:
+        return self.process is not None and self.thread is not None and self.thread.is_alive()
+
+    def _inhibit(self):
+        if shutil.which("systemd-inhibit") is None:
+            return
+        with self.inhibit_lock:
+            if self.inhibitor is not None:
+                return
+            try:
+                self.inhibitor = subprocess.Popen(
+                    self.INHIBIT_COMMAND, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+                )
+            except OSError as e:
+                logger.warning(f"Cannot take a sleep delay lock: {e}")
+
+    def release(self):
+        """
+        Lets the system go to sleep, called once everything was done that needs to happen before.
+        """
+        with self.inhibit_lock:
+            inhibitor, self.inhibitor = self.inhibitor, None
+        if inhibitor is not None:
+            inhibitor.stdin.close()
+            inhibitor.terminate()
+            inhibitor.wait()
+
+    def _run(self):
+        process = self.process
+        for line in process.stdout:
+            if b".PrepareForSleep (" not in line:
+                continue
+            if b"(true," in line:
+                logger.info("System is going to sleep")
+                self.on_sleep()
+            elif b"(false," in line:
+                # Delay the next suspend again
+                self._inhibit()
+                self.on_wake()
+        if self.process is not None:
+            logger.warning("Logind monitor exited, detecting resume by polling the clocks only")
+            # Nobody would release the lock before the next suspend anymore
+            self.release()
+
+    def stop(self):
+        process, self.process = self.process, None
+        if process is not None:
+            process.terminate()
+            process.wait()
+        self.release()
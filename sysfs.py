@@ -0,0 +1,77 @@
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+
+class SysfsFile:
+    """
+    A kept-open sysfs/procfs attribute file that is re-read with pread.
+    sysfs regenerates the attribute content on every read at offset 0,
+    so the file never needs to be reopened or seeked.
+    """
+
+    def __init__(self, path: str, size: int = 4096):
+        self.path = path
+        self.size = size
+        self.fd = None
+        self.fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+
+    def read(self) -> bytes:
+        data = os.pread(self.fd, self.size, 0)
+        # Files like /proc/stat grow with the number of CPUs, make sure we got all of it
+        while len(data) == self.size:
+            self.size *= 2
+            data = os.pread(self.fd, self.size, 0)
+        return data
+
+    def read_int(self) -> int:
+        return int(self.read())
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except OSError:
+            pass
+
+
+def open_optional(path: str, size: int = 4096) -> Optional[SysfsFile]:
+    """
+    Opens an attribute file that may not exist, e.g. because a controller or driver does not
+    provide it or it is readable by root only. Returns None if it cannot be opened.
+    """
+    try:
+        return SysfsFile(path, size)
+    except OSError:
+        return None
+
+
+class CachedSnapshot:
+    """
+    Base of readers that several sensors read in the same tick. get() refreshes the readings
+    if they are older than max_age, so the sensors share one read of the underlying files.
+    Subclasses implement refresh(), which is called with the lock held and sets refreshed.
+    """
+
+    def __init__(self, max_age: float = 0.5, clock: Callable[[], float] = time.monotonic):
+        self.max_age = max_age
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.refreshed: Optional[float] = None
+
+    def refresh(self):
+        raise NotImplementedError
+
+    def get(self, func: Callable):
+        """
+        Refreshes the readings if needed and returns func(self).
+        """
+        with self.lock:
+            if self.refreshed is None or self.clock() - self.refreshed >= self.max_age:
+                self.refresh()
+            return func(self)
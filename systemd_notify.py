@@ -0,0 +1,71 @@
+import os
+import socket
+from typing import Optional
+
+from loguru import logger
+
+
+class SystemdNotifier:
+    """
+    Sends sd_notify messages (READY=1, WATCHDOG=1, ...) to systemd without libsystemd.
+    Everything is a no-op if the service was not started with Type=notify.
+    """
+
+    def __init__(self):
+        self.address = os.environ.get("NOTIFY_SOCKET")
+        self.socket = None
+        if not self.address:
+            return
+        if self.address.startswith("@"):
+            # Abstract namespace socket
+            self.address = "\0" + self.address[1:]
+        try:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM | socket.SOCK_CLOEXEC)
+        except OSError as e:
+            logger.warning(f"Cannot create the systemd notification socket: {e}")
+
+    def notify(self, state: str) -> bool:
+        if self.socket is None:
+            return False
+        try:
+            self.socket.sendto(state.encode(), self.address)
+        except OSError as e:
+            logger.warning(f"Error notifying systemd: {e}")
+            return False
+        return True
+
+    def ready(self):
+        self.notify("READY=1")
+
+    def stopping(self):
+        self.notify("STOPPING=1")
+
+    def reloading(self):
+        self.notify("RELOADING=1")
+
+    def watchdog(self):
+        self.notify("WATCHDOG=1")
+
+    def status(self, text: str):
+        self.notify(f"STATUS={text}")
+
+    def watchdog_interval(self) -> Optional[float]:
+        """
+        Returns the interval in seconds to send WATCHDOG=1 at, None if the watchdog is not enabled.
+        Half of WatchdogSec, as recommended by sd_watchdog_enabled(3).
+        """
+        if self.socket is None:
+            return None
+        pid = os.environ.get("WATCHDOG_PID")
+        if pid and pid != str(os.getpid()):
+            return None
+        try:
+            usec = int(os.environ.get("WATCHDOG_USEC", "0"))
+        except ValueError:
+            return None
+        return usec / 2e6 if usec > 0 else None
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
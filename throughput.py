@@ -0,0 +1,241 @@
+import fnmatch
+import re
+import time
+from typing import Callable, Collection, Dict, List, Optional, Tuple
+
+from sysfs import CachedSnapshot, SysfsFile, open_optional
+
+# /proc/diskstats counts sectors of 512 bytes, independent of the device's sector size
+SECTOR_SIZE = 512
+
+
+def compile_patterns(patterns: str) -> Optional[re.Pattern]:
+    """
+    Compiles a comma or whitespace separated list of shell patterns into a single regex.
+    """
+    patterns = [p for p in re.split(r"[,\s]+", patterns or "") if p]
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{fnmatch.translate(p)})" for p in patterns))
+
+
+class DeviceFilter:
+    """
+    Include/exclude patterns for device names, compiled once.
+    Decisions are cached per name, so hosts with hundreds of veth or loop devices
+    only pay one dictionary lookup per device and tick.
+    """
+
+    def __init__(self, include: str = "*", exclude: str = ""):
+        self.include = compile_patterns(include)
+        self.exclude = compile_patterns(exclude)
+        self.cache: Dict[bytes, bool] = {}
+
+    def __call__(self, name: bytes) -> bool:
+        allowed = self.cache.get(name)
+        if allowed is None:
+            text = name.decode(errors="replace")
+            allowed = bool(self.include and self.include.match(text)) and not (
+                self.exclude and self.exclude.match(text)
+            )
+            self.cache[name] = allowed
+        return allowed
+
+    def retain(self, names: Collection[bytes]):
+        """
+        Rebuilds the cache from the names that currently exist, so the decisions of removed
+        devices, e.g. short-lived veth interfaces, do not pile up.
+        """
+        if len(self.cache) > len(names):
+            self.cache = {name: self.cache[name] for name in names if name in self.cache}
+
+
+class DeviceIdentities:
+    """
+    Notices devices that were removed and added again under the same name between two reads,
+    whose counters start over. An attribute file of every device is kept open and re-read,
+    the file of a removed device returns ENODEV even if a new one with the same name exists.
+    """
+
+    def __init__(self, path_format: str):
+        self.path_format = path_format
+        # None if the device has no such file, then re-creation cannot be detected
+        self.files: Dict[str, Optional[SysfsFile]] = {}
+        self.values: Dict[str, bytes] = {}
+
+    def _open(self, name: str):
+        file = open_optional(self.path_format.format(name=name), 64)
+        try:
+            self.values[name] = file.read() if file is not None else b""
+        except OSError:
+            file.close()
+            file = None
+        self.files[name] = file
+
+    def recreated(self, names: Collection[str]) -> List[str]:
+        """
+        Returns the names that belong to a different device than at the last call.
+        """
+        for name in [name for name in self.files if name not in names]:
+            self._close(name)
+        recreated = []
+        for name in names:
+            if name not in self.files:
+                self._open(name)
+                continue
+            file = self.files[name]
+            if file is None:
+                continue
+            try:
+                if file.read() == self.values[name]:
+                    continue
+            except OSError:
+                pass
+            recreated.append(name)
+            file.close()
+            self._open(name)
+        return recreated
+
+    def _close(self, name: str):
+        file = self.files.pop(name)
+        self.values.pop(name, None)
+        if file is not None:
+            file.close()
+
+    def close(self):
+        for name in list(self.files):
+            self._close(name)
+
+
+def counter_delta(current: int, previous: int) -> int:
+    """
+    Difference of two counter values, handling a wrap of 32 or 64 bit counters.
+    A counter that went down has wrapped, a counter that starts over because its device
+    was added again must not be compared with the value of the old device.
+    """
+    delta = current - previous
+    if delta >= 0:
+        return delta
+    # A value that does not fit into 32 bits comes from a 64 bit counter
+    return delta + (2**32 if previous < 2**32 else 2**64)
+
+
+class CounterRates:
+    """
+    Turns per-device counter tuples into per-second rates using monotonic time deltas.
+    """
+
+    def __init__(self):
+        self.previous: Dict[str, Tuple[int, ...]] = {}
+        self.rates: Dict[str, Tuple[float, ...]] = {}
+        self.timestamp: Optional[float] = None
+
+    def update(self, counters: Dict[str, Tuple[int, ...]], now: float, recreated: Collection[str] = ()):
+        """
+        recreated are the devices whose counters started over since the last update,
+        they have no rate until the next one, like devices that were just added.
+        """
+        if self.timestamp is not None and now > self.timestamp:
+            elapsed = now - self.timestamp
+            rates = {}
+            for name, values in counters.items():
+                last = self.previous.get(name)
+                if last is not None and name not in recreated:
+                    rates[name] = tuple(counter_delta(c, p) / elapsed for c, p in zip(values, last))
+            self.rates = rates
+        self.previous = counters
+        self.timestamp = now
+
+
+class ThroughputSnapshot(CachedSnapshot):
+    """
+    Reads /proc/diskstats and /proc/net/dev once per tick through kept-open files
+    and computes the rates of the selected disks and network interfaces.
+    Disk rates are (read bytes/s, written bytes/s, read IOPS, write IOPS), network
+    rates are (received bytes/s, sent bytes/s, received packets/s, sent packets/s).
+    """
+
+    def __init__(
+        self,
+        disk_filter: DeviceFilter = None,
+        net_filter: DeviceFilter = None,
+        proc: str = "/proc",
+        sys: str = "/sys",
+        max_age: float = 0.5,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.disk_filter = disk_filter
+        self.net_filter = net_filter
+        self.diskstats = SysfsFile(f"{proc}/diskstats", 16384) if disk_filter else None
+        self.netdev = SysfsFile(f"{proc}/net/dev", 16384) if net_filter else None
+        self.disks = CounterRates()
+        self.net = CounterRates()
+        self.disk_identities = DeviceIdentities(f"{sys}/class/block/{{name}}/dev")
+        self.net_identities = DeviceIdentities(f"{sys}/class/net/{{name}}/ifindex")
+        super().__init__(max_age, clock)
+        # Take the first sample now, so the first refresh already yields rates
+        self.refresh()
+
+    def _read_diskstats(self) -> Dict[str, Tuple[int, ...]]:
+        counters = {}
+        names = []
+        for line in self.diskstats.read().splitlines():
+            fields = line.split()
+            if len(fields) < 10:
+                continue
+            names.append(fields[2])
+            if not self.disk_filter(fields[2]):
+                continue
+            # Sectors read and written, reads and writes completed.
+            # Sectors are converted to bytes after computing the delta, so a counter wrap is detected correctly
+            counters[fields[2].decode()] = (int(fields[5]), int(fields[9]), int(fields[3]), int(fields[7]))
+        self.disk_filter.retain(names)
+        return counters
+
+    def _read_netdev(self) -> Dict[str, Tuple[int, ...]]:
+        counters = {}
+        names = []
+        # The first two lines are headers
+        for line in self.netdev.read().splitlines()[2:]:
+            name, _, values = line.partition(b":")
+            name = name.strip()
+            names.append(name)
+            if not self.net_filter(name):
+                continue
+            fields = values.split()
+            counters[name.decode()] = (int(fields[0]), int(fields[8]), int(fields[1]), int(fields[9]))
+        self.net_filter.retain(names)
+        return counters
+
+    def refresh(self):
+        now = self.clock()
+        if self.diskstats is not None:
+            counters = self._read_diskstats()
+            self.disks.update(counters, now, self.disk_identities.recreated(counters))
+        if self.netdev is not None:
+            counters = self._read_netdev()
+            self.net.update(counters, now, self.net_identities.recreated(counters))
+        self.refreshed = now
+
+    def disk_names(self) -> List[str]:
+        return sorted(self.disks.previous)
+
+    def net_names(self) -> List[str]:
+        return sorted(self.net.previous)
+
+    def disk_rate(self, name: str, index: int) -> Optional[float]:
+        rates = self.disks.rates.get(name)
+        if rates is None:
+            return None
+        return rates[index] * SECTOR_SIZE if index < 2 else rates[index]
+
+    def net_rate(self, name: str, index: int) -> Optional[float]:
+        rates = self.net.rates.get(name)
+        return None if rates is None else rates[index]
+
+    def close(self):
+        for file in (self.diskstats, self.netdev):
+            if file is not None:
+                file.close()
+        self.disk_identities.close()
+        self.net_identities.close()
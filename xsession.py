@@ -0,0 +1,203 @@
+import select
+import threading
+import time
+from typing import Callable, List, Optional
+
+from loguru import logger
+from Xlib import X, display
+from Xlib.error import ConnectionClosedError
+from Xlib.ext import screensaver
+from Xlib.X import AnyPropertyType
+
+from proctable import ProcessTable
+
+# How long the event thread waits for X events before checking if it should exit
+EVENT_POLL_TIMEOUT = 1.0
+# How long to wait before connecting again if the X server is not available
+RECONNECT_DELAY = 10.0
+# How often to check the idle time for user activity once an idle threshold was crossed
+IDLE_ACTIVE_POLL = 1.0
+
+
+class XSession:
+    """
+    A single long-lived connection to the X server.
+    Atoms are interned once, and a background thread listens for
+    PropertyNotify on the root window to report focus changes immediately.
+    The same thread reports crossings of the configured idle thresholds, waking
+    up only when the next threshold can be reached or, once idle, to detect activity.
+    All access to the display is serialized through `lock`, as python-xlib
+    connections are not thread safe.
+    """
+
+    def __init__(self, idle_thresholds: List[float] = None, process_table: ProcessTable = None):
+        self.display: Optional[display.Display] = None
+        self.root = None
+        self.has_screensaver = False
+        self.lock = threading.RLock()
+        self.atoms = {}
+        self.active_window_listeners: List[Callable] = []
+        self.idle_listeners: List[Callable] = []
+        self.idle_thresholds = sorted(idle_thresholds or [])
+        self.idle_level = 0
+        self.next_idle_check = 0.0
+        # Shared with the top processes sensor, if enabled
+        self.processes = process_table or ProcessTable()
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def connect(self) -> bool:
+        with self.lock:
+            if self.display is not None:
+                return True
+            try:
+                self.display = display.Display()
+                self.root = self.display.screen().root
+                self.atoms = {
+                    name: self.display.intern_atom(name) for name in ("_NET_ACTIVE_WINDOW", "_NET_WM_PID")
+                }
+                self.root.change_attributes(event_mask=X.PropertyChangeMask)
+                self.has_screensaver = self.display.has_extension(screensaver.extname)
+                self.display.flush()
+            except Exception as e:
+                logger.warning(f"Cannot connect to X server: {e}")
+                self._close_display()
+                return False
+            logger.debug(f"Connected to X server {self.display.get_display_name()}")
+            return True
+
+    def _close_display(self):
+        if self.display is not None:
+            try:
+                self.display.close()
+            except Exception:
+                pass
+        self.display = None
+        self.root = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._event_loop, name="xsession", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout=2 * EVENT_POLL_TIMEOUT)
+            self.thread = None
+        with self.lock:
+            self._close_display()
+
+    def add_active_window_listener(self, callback: Callable):
+        self.active_window_listeners.append(callback)
+
+    def add_idle_listener(self, callback: Callable):
+        """
+        The callback is called with the idle time in seconds whenever an idle threshold is crossed,
+        in either direction.
+        """
+        self.idle_listeners.append(callback)
+
+    def _event_loop(self):
+        while not self.stopped.is_set():
+            if not self.connect():
+                # The X server might not be up yet, try again later
+                self.stopped.wait(RECONNECT_DELAY)
+                continue
+            try:
+                timeout = EVENT_POLL_TIMEOUT
+                if self.idle_thresholds and self.idle_listeners:
+                    timeout = max(0.0, min(timeout, self.next_idle_check - time.monotonic()))
+                select.select([self.display.fileno()], [], [], timeout)
+                # Also handle events that were already read from the socket by a query on another thread
+                self._handle_events()
+                if self.idle_thresholds and self.idle_listeners and time.monotonic() >= self.next_idle_check:
+                    self._check_idle()
+            except Exception as e:
+                logger.warning(f"Lost connection to X server: {e}")
+                with self.lock:
+                    self._close_display()
+
+    def _handle_events(self):
+        focus_changed = False
+        with self.lock:
+            # pending_events() reads whatever the server has sent so far
+            while self.display.pending_events():
+                event = self.display.next_event()
+                if event.type == X.PropertyNotify and event.atom == self.atoms["_NET_ACTIVE_WINDOW"]:
+                    focus_changed = True
+        if focus_changed:
+            for callback in self.active_window_listeners:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error(f"Error in active window listener: {e}")
+
+    def _check_idle(self):
+        idle = self.get_idle()
+        now = time.monotonic()
+        if idle is None:
+            self.next_idle_check = now + RECONNECT_DELAY
+            return
+        level = sum(1 for threshold in self.idle_thresholds if idle >= threshold)
+        if level < len(self.idle_thresholds):
+            # Nothing can happen before the next threshold is reached, unless the user becomes active
+            next_check = now + self.idle_thresholds[level] - idle
+        else:
+            next_check = float("inf")
+        if level > 0:
+            # Only polling can tell when the user becomes active again
+            next_check = min(next_check, now + IDLE_ACTIVE_POLL)
+        self.next_idle_check = next_check
+        if level != self.idle_level:
+            self.idle_level = level
+            for callback in self.idle_listeners:
+                try:
+                    callback(idle)
+                except Exception as e:
+                    logger.error(f"Error in idle listener: {e}")
+
+    def get_idle(self) -> Optional[float]:
+        """
+        Returns the X server idle time in seconds using the MIT-SCREEN-SAVER extension,
+        or None if it is not available.
+        """
+        if not self.connect():
+            return None
+        with self.lock:
+            if not self.has_screensaver:
+                return None
+            try:
+                return self.root.screensaver_query_info().idle / 1000
+            except ConnectionClosedError as e:
+                logger.warning(f"Lost connection to X server: {e}")
+                self._close_display()
+            except Exception as e:
+                logger.warning(f"Error querying X idle time: {e}")
+        return None
+
+    def get_active_window_process(self) -> Optional[str]:
+        if not self.connect():
+            return None
+        with self.lock:
+            try:
+                active = self.root.get_full_property(self.atoms["_NET_ACTIVE_WINDOW"], AnyPropertyType)
+                if not active or not active.value or not active.value[0]:
+                    return None
+                window = self.display.create_resource_object("window", active.value[0])
+                pid = window.get_full_property(self.atoms["_NET_WM_PID"], 0)
+                wm_class = window.get_wm_class()
+            except ConnectionClosedError as e:
+                logger.warning(f"Lost connection to X server: {e}")
+                self._close_display()
+                return None
+            except Exception as e:
+                # e.g. BadWindow if the window was closed while we were looking at it
+                logger.warning(f"Error getting active window process: {e}")
+                return None
+        process = self.processes.describe(pid.value[0]) if pid else None
+        if wm_class and wm_class[0]:
+            process = f"{wm_class[0]} - {process}" if process else wm_class[0]
+        return process